@@ -0,0 +1,260 @@
+"""A minimal stand in for the earth engine api used by datamodules.gee.
+
+Only the calls made by the GEE datamodule are implemented. Every getInfo or
+getMapId sleeps for latency seconds to mimic a network round trip and is
+counted in MockEE.ncalls.
+"""
+
+import sys
+import time
+import types
+
+import numpy as np
+
+
+class MockEE:
+    latency = 0.0
+    nimages = 10
+    size = 100
+    ncalls = 0
+
+
+def resolve(value):
+    """Evaluate nested mock values as the server would."""
+    if isinstance(value, Computed):
+        return resolve(value.value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, dict):
+        return {k: resolve(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [resolve(v) for v in value]
+    return value
+
+
+class Computed:
+    def __init__(self, value=None) -> None:
+        self.value = value
+
+    def getInfo(self):
+        MockEE.ncalls += 1
+        time.sleep(MockEE.latency)
+        return resolve(self.value)
+
+    def millis(self):
+        return Computed(self.value["value"])
+
+
+class Date(Computed):
+    def __init__(self, value) -> None:
+        if isinstance(value, str):
+            value = np.datetime64(value, "ms").astype(int)
+        super().__init__({"type": "Date", "value": int(value)})
+
+
+class Geometry(Computed):
+    @staticmethod
+    def Polygon(coords, proj=None):
+        return Geometry({"type": "Polygon", "coordinates": coords})
+
+    @staticmethod
+    def Point(coords, proj=None):
+        return Geometry({"type": "Point", "coordinates": coords})
+
+
+class Filter:
+    @staticmethod
+    def date(sdt, edt):
+        return ("date", sdt, edt)
+
+    @staticmethod
+    def eq(key, value):
+        return ("eq", key, value)
+
+    @staticmethod
+    def listContains(key, value):
+        return ("listContains", key, value)
+
+
+class Reducer:
+    """Reducers only keep their output names, values are made up."""
+
+    def __init__(self, outputs: list[str]) -> None:
+        self.outputs = list(outputs)
+
+    @staticmethod
+    def mean():
+        return Reducer(["mean"])
+
+    @staticmethod
+    def stdDev():
+        return Reducer(["stdDev"])
+
+    @staticmethod
+    def count():
+        return Reducer(["count"])
+
+    @staticmethod
+    def percentile(percentiles, outputNames=None):
+        return Reducer(outputNames or [f"p{q}" for q in percentiles])
+
+    def setOutputs(self, outputs):
+        return Reducer(outputs)
+
+    def combine(self, reducer2, sharedInputs=False):
+        return Reducer(self.outputs + reducer2.outputs)
+
+
+class Feature(Computed):
+    def __init__(self, geom, props: dict) -> None:
+        super().__init__({"type": "Feature", "geometry": geom, "properties": props})
+
+    def get(self, key):
+        return Computed(self.value["properties"][key])
+
+    def set(self, props: dict):
+        return Feature(
+            self.value["geometry"], {**resolve(self.value["properties"]), **props}
+        )
+
+
+class FeatureCollection(Computed):
+    def __init__(self, feats) -> None:
+        if isinstance(feats, ImageCollection):
+            feats = feats.mapped
+        super().__init__({"type": "FeatureCollection", "features": feats})
+
+    def flatten(self):
+        feats = []
+        for fc in self.value["features"]:
+            feats += fc.value["features"]
+        return FeatureCollection(feats)
+
+    def toList(self, count, offset=0):
+        return Computed(self.value["features"][offset : offset + count])
+
+    def size(self):
+        return Computed(len(self.value["features"]))
+
+
+class Image(Computed):
+    band_names = ["VV", "VH", "angle"]
+
+    def __init__(self, id: str = "", bands: list[str] = None) -> None:
+        self.id = id
+        self.bands = bands or list(self.band_names)
+        ind = int(id.split("_")[-1]) if id else 0
+        self.millis = int(np.datetime64("2022-03-14", "ms").astype(int)) + ind * 864e5
+        super().__init__({"type": "Image", "id": id, "bands": self.bands})
+
+    @staticmethod
+    def pixelLonLat():
+        return Image(bands=["longitude", "latitude"])
+
+    def get(self, key):
+        return Computed(self.id)
+
+    def date(self):
+        return Date(self.millis)
+
+    def bandNames(self):
+        return Computed(self.bands)
+
+    def toDictionary(self):
+        return Computed({"instrumentMode": "IW", "orbitProperties_pass": "ASCENDING"})
+
+    def select(self, bname):
+        return Image(self.id, bname if isinstance(bname, list) else [bname])
+
+    def projection(self):
+        return Computed({"crs": "EPSG:32612"})
+
+    def addBands(self, img):
+        return Image(self.id, self.bands + img.bands)
+
+    def reproject(self, proj):
+        return self
+
+    def setDefaultProjection(self, proj):
+        return self
+
+    def unmask(self, value):
+        return self
+
+    def sampleRectangle(self, geom):
+        size = MockEE.size
+        rng = np.random.default_rng(0)
+        props = {}
+        for bname in self.bands:
+            if bname == "longitude":
+                arr = np.tile(np.linspace(-111.61, -111.56, size), (size, 1))
+            elif bname == "latitude":
+                arr = np.tile(np.linspace(58.92, 58.89, size)[:, None], (1, size))
+            else:
+                arr = rng.normal(-15, 3, (size, size))
+            props[bname] = arr
+        return Feature(geom, props)
+
+    def reduceRegion(self, reducer, geometry, scale=None, maxPixels=None):
+        if isinstance(reducer, Reducer) and len(reducer.outputs) > 1:
+            return Computed(
+                {
+                    f"{bname}_{out}": -15.0
+                    for bname in self.bands
+                    for out in reducer.outputs
+                }
+            )
+        return Computed({bname: -15.0 for bname in self.bands})
+
+    def getMapId(self, vis_params):
+        MockEE.ncalls += 1
+        time.sleep(MockEE.latency)
+        return {"tile_fetcher": types.SimpleNamespace(url_format="")}
+
+
+class ImageCollection(Computed):
+    def __init__(self, name: str, images: list = None) -> None:
+        self.name = name
+        if images is None:
+            images = [Image(f"{name}/S1A_IW_{i:03d}") for i in range(MockEE.nimages)]
+        self.images = images
+        self.mapped = None
+        super().__init__(
+            {"type": "ImageCollection", "features": [img.value for img in images]}
+        )
+
+    def filter(self, filt):
+        return self
+
+    def filterBounds(self, geom):
+        return self
+
+    def map(self, fn):
+        col = ImageCollection(self.name, self.images)
+        col.mapped = [fn(img) for img in self.images]
+        return col
+
+
+def install(latency: float = 0.0, nimages: int = 10, size: int = 100):
+    """Register the mock as the ee module, call before importing datamodules.gee."""
+    MockEE.latency = latency
+    MockEE.nimages = nimages
+    MockEE.size = size
+    MockEE.ncalls = 0
+    ee = types.ModuleType("ee")
+    for obj in [
+        Date,
+        Geometry,
+        Filter,
+        Reducer,
+        Feature,
+        FeatureCollection,
+        Image,
+        ImageCollection,
+    ]:
+        setattr(ee, obj.__name__, obj)
+    ee.Initialize = lambda *args, **kwargs: None
+    ee.Authenticate = lambda *args, **kwargs: None
+    ee.feature = types.SimpleNamespace(Feature=Feature)
+    sys.modules["ee"] = ee
+    return ee
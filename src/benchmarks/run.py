@@ -0,0 +1,317 @@
+"""Time the RCM geotiff and GEE datamodules on synthetic data.
+
+Each benchmark runs in a fresh process so that its peak memory can be
+measured. Results are written as json and can be compared between commits:
+
+    python -m benchmarks.run --sizes 1000 4000 --out new.json --compare old.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime as dt
+
+import numpy as np
+
+from benchmarks.synthetic import CRS, META_MAP, SUBDIR, aoi_for_size, make_rcm_dataset
+from runner.profiler import peak_rss_mb
+
+BENCHES = {}
+
+# slow imports that a local geotiff run should not need
+HEAVY_MODULES = ["matplotlib", "geopandas", "shapely", "ee", "folium", "geopy"]
+IMPORT_CHECK = """
+import sys, time
+t0 = time.perf_counter()
+import {module}
+print(time.perf_counter() - t0)
+print(",".join(m for m in {heavy} if m in sys.modules))
+"""
+
+
+def bench(name: str):
+    def register(fn):
+        BENCHES[name] = fn
+        return fn
+
+    return register
+
+
+def make_rcmdm(datadir: str, outdir: str, size: int, **kwargs):
+    from omegaconf import OmegaConf
+
+    from datamodules.geotiff import RCMDM
+
+    return RCMDM(
+        dir=datadir,
+        ext="MLC",
+        outdir=outdir,
+        aoi=OmegaConf.create(aoi_for_size(size)),
+        aoi_crs=CRS,
+        meta_map=META_MAP,
+        subdir=SUBDIR,
+        crs=CRS,
+        lims_for_plotting={},
+        pipeline=["subset"],
+        **kwargs,
+    )
+
+
+@bench("read")
+def bench_read(datadir: str, outdir: str, size: int) -> dict:
+    dm = make_rcmdm(datadir, outdir, size)
+    t0 = time.perf_counter()
+    for file in dm.filelist:
+        dm.read_file(file)
+    return {"seconds": time.perf_counter() - t0, "nitems": len(dm.filelist)}
+
+
+@bench("subset")
+def bench_subset(datadir: str, outdir: str, size: int) -> dict:
+    dm = make_rcmdm(datadir, outdir, size)
+    seconds = 0
+    for file in dm.filelist:
+        prod = dm.read_file(file)
+        t0 = time.perf_counter()
+        dm.subset(prod)
+        seconds += time.perf_counter() - t0
+    return {"seconds": seconds, "nitems": len(dm.filelist)}
+
+
+@bench("read_subset_lazy")
+def bench_read_subset_lazy(datadir: str, outdir: str, size: int) -> dict:
+    dm = make_rcmdm(datadir, outdir, size, lazy=True)
+    t0 = time.perf_counter()
+    for file in dm.filelist:
+        dm.subset(dm.read_file(file))
+    return {"seconds": time.perf_counter() - t0, "nitems": len(dm.filelist)}
+
+
+@bench("lin_to_db")
+def bench_lin_to_db(datadir: str, outdir: str, size: int) -> dict:
+    from datamodules.utils import lin_to_db
+
+    arr = np.random.default_rng(0).exponential(0.05, (size, size)).astype("float32")
+    t0 = time.perf_counter()
+    lin_to_db(arr)
+    return {"seconds": time.perf_counter() - t0, "nitems": 1}
+
+
+@bench("crs_transform")
+def bench_crs_transform(datadir: str, outdir: str, size: int) -> dict:
+    from xarray import DataArray
+
+    from datamodules.utils import crs_transform
+
+    arr = DataArray(
+        np.zeros((size, size), dtype="float32"),
+        dims=["y", "x"],
+        coords={
+            "y": 5200000.0 - 5 * np.arange(size),
+            "x": 300000.0 + 5 * np.arange(size),
+        },
+    )
+    t0 = time.perf_counter()
+    crs_transform(arr, CRS, "EPSG:4326", dtype=np.float32)
+    return {"seconds": time.perf_counter() - t0, "nitems": 1}
+
+
+@bench("plot")
+def bench_plot(datadir: str, outdir: str, size: int) -> dict:
+    dm = make_rcmdm(datadir, outdir, size, lazy=True)
+    prods = [dm.subset(dm.read_file(file)) for file in dm.filelist]
+    t0 = time.perf_counter()
+    for prod in prods:
+        dm.plot(prod)
+    return {"seconds": time.perf_counter() - t0, "nitems": len(prods)}
+
+
+@bench("timeseries")
+def bench_timeseries(datadir: str, outdir: str, size: int) -> dict:
+    dm = make_rcmdm(datadir, outdir, size, lazy=True, ts_percentiles=[10, 90])
+    prods = [dm.subset(dm.read_file(file)) for file in dm.filelist]
+    t0 = time.perf_counter()
+    for prod in prods:
+        for row in dm.summarise(prod):
+            dm.accumulator.add(row)
+    dm.timeseries()
+    return {"seconds": time.perf_counter() - t0, "nitems": len(prods)}
+
+
+def import_time(module: str, repeat: int = 3) -> tuple[float, list[str]]:
+    """Best time to import module in a fresh interpreter, and the heavy modules
+    it pulled in."""
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = IMPORT_CHECK.format(module=module, heavy=HEAVY_MODULES)
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=src, capture_output=True, text=True
+        )
+        if out.returncode != 0:
+            raise Exception(out.stderr)
+        seconds, heavy = out.stdout.split("\n")[:2]
+        times.append(float(seconds))
+    return min(times), [m for m in heavy.split(",") if m]
+
+
+@bench("import")
+def bench_import(datadir: str, outdir: str, size: int) -> dict:
+    """Startup cost of proc for a local geotiff run (size is not used)."""
+    out = {"modules": {}}
+    for module in ["datamodules.base", "runner.scene", "datamodules.geotiff"]:
+        out["modules"][module], heavy = import_time(module)
+    out["seconds"] = out["modules"]["datamodules.geotiff"]
+    out["nitems"] = 1
+    out["heavy_loaded"] = heavy
+    return out
+
+
+@bench("gee")
+def bench_gee(datadir: str, outdir: str, size: int) -> dict:
+    from omegaconf import OmegaConf
+
+    from benchmarks import mock_ee
+
+    mock_ee.install(latency=0.05, nimages=10, size=min(size, 500))
+    from datamodules.gee import GEEDMS1
+
+    aoi = [[[-111.61, 58.89], [-111.56, 58.89], [-111.56, 58.92], [-111.61, 58.92]]]
+    t0 = time.perf_counter()
+    dm = GEEDMS1(
+        outdir=outdir,
+        sdt="2022-03-14",
+        edt="2022-07-01",
+        aoi=OmegaConf.create(aoi),
+        ee_rate=0,
+    )
+    for file in dm.filelist:
+        prod = dm.subset(dm.read_file(file))
+        prod.get_band("VV")
+        prod.get_band("longitude")
+    return {
+        "seconds": time.perf_counter() - t0,
+        "nitems": len(dm.filelist),
+        "ee_calls": mock_ee.MockEE.ncalls,
+    }
+
+
+@bench("gee_ts")
+def bench_gee_ts(datadir: str, outdir: str, size: int) -> dict:
+    """Earth engine requests for a timeseries fetched per image or per collection."""
+    from omegaconf import OmegaConf
+
+    from benchmarks import mock_ee
+
+    mock_ee.install(latency=0.05, nimages=100, size=min(size, 500))
+    from datamodules.gee import GEEDMS1
+
+    aoi = [[[-111.61, 58.89], [-111.56, 58.89], [-111.56, 58.92], [-111.61, 58.92]]]
+    out = {"nitems": mock_ee.MockEE.nimages}
+    for mode in ["scene", "collection"]:
+        dm = GEEDMS1(
+            outdir=f"{outdir}{mode}/",
+            sdt="2022-03-14",
+            edt="2022-07-01",
+            aoi=OmegaConf.create(aoi),
+            ee_rate=0,
+            ts_mode=mode,
+        )
+        ncalls = mock_ee.MockEE.ncalls
+        t0 = time.perf_counter()
+        for file in dm.filelist:
+            for row in dm.summarise(dm.read_file(file)):
+                dm.accumulator.add(row)
+        dm.timeseries()
+        out[f"{mode}_seconds"] = time.perf_counter() - t0
+        out[f"{mode}_ee_calls"] = mock_ee.MockEE.ncalls - ncalls
+    out["seconds"] = out["collection_seconds"]
+    return out
+
+
+def run_child(name: str, datadir: str, outdir: str, size: int) -> dict:
+    os.environ["MPLBACKEND"] = "Agg"
+    with contextlib.redirect_stdout(io.StringIO()):
+        out = BENCHES[name](datadir, outdir, size)
+    out["peak_rss_mb"] = peak_rss_mb()
+    return out
+
+
+def run_isolated(name: str, datadir: str, outdir: str, size: int) -> dict:
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(run_child, (name, datadir, outdir, size))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(new: dict, old: dict) -> None:
+    """Print the ratio of new to old times for benchmarks in both results."""
+    oldres = {(r["bench"], r["size"]): r for r in old["results"]}
+    print(f"\n{'bench':<18}{'size':>8}{'old (s)':>10}{'new (s)':>10}{'ratio':>8}")
+    for res in new["results"]:
+        key = (res["bench"], res["size"])
+        if key not in oldres:
+            continue
+        told, tnew = oldres[key]["seconds"], res["seconds"]
+        print(f"{key[0]:<18}{key[1]:>8}{told:>10.3f}{tnew:>10.3f}{tnew / told:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000])
+    parser.add_argument("--nscenes", type=int, default=3)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHES), default=None)
+    parser.add_argument("--workdir", default="bench_data/")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", default=None, help="earlier results json")
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "date": dt.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": [],
+    }
+    for size in args.sizes:
+        datadir = os.path.join(args.workdir, f"rcm_{size}", "")
+        outdir = os.path.join(args.workdir, f"out_{size}", "")
+        print(f"making {args.nscenes} synthetic scenes of {size}x{size} pixels")
+        make_rcm_dataset(datadir, args.nscenes, size)
+        for name in args.only or BENCHES:
+            res = run_isolated(name, datadir, outdir, size)
+            res.update({"bench": name, "size": size})
+            results["results"].append(res)
+            print(
+                f"{name:<18}{size:>8}{res['seconds']:>10.3f} s"
+                f"{res['peak_rss_mb'] or float('nan'):>10.0f} MB"
+            )
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"saved benchmark results to: {args.out}")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
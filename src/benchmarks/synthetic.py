@@ -0,0 +1,89 @@
+import os
+from datetime import datetime as dt
+from datetime import timedelta
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+# filename layout matching meta_map {date: 5, time: 6, sat: 0, mode: 4, band: 6}
+SCENE_FMT = "{sat}_OK0000001_PK0000001_1_{mode}_{date}_{time}_HH_HV_MLC"
+BAND_FMT = "{sat}_OK0000001_PK0000001_1_{mode}_{date}_{band}_orf.tif"
+META_MAP = {"date": 5, "time": 6, "sat": 0, "mode": 4, "band": 6}
+SUBDIR = "seq8_orf/"
+CRS = "EPSG:2960"
+ORIGIN = (300000.0, 5200000.0)
+RES = 5.0
+
+
+def write_band(path: str, size: int, seed: int, block: int = 1024) -> None:
+    """Write a single band float32 geotiff of linear backscatter, block by block."""
+    rng = np.random.default_rng(seed)
+    profile = {
+        "driver": "GTiff",
+        "height": size,
+        "width": size,
+        "count": 1,
+        "dtype": "float32",
+        "crs": CRS,
+        "transform": from_origin(ORIGIN[0], ORIGIN[1], RES, RES),
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+    }
+    with rasterio.open(path, "w", **profile) as f:
+        for row in range(0, size, block):
+            nrows = min(block, size - row)
+            arr = rng.exponential(0.05, (nrows, size)).astype("float32")
+            # nodata border like a real scene footprint
+            arr[:, : size // 50] = 0
+            f.write(arr, 1, window=Window(0, row, size, nrows))
+
+
+def make_rcm_scene(
+    root: str,
+    date: dt,
+    size: int,
+    bands: list[str] = ["HH", "HV", "iae"],
+    sat: str = "RCM1",
+    mode: str = "QP",
+) -> str:
+    """Create an RCM style scene directory with one geotiff per band."""
+    meta = {
+        "sat": sat,
+        "mode": mode,
+        "date": date.strftime("%Y%m%d"),
+        "time": date.strftime("%H%M%S"),
+    }
+    scene = os.path.join(root, SCENE_FMT.format(**meta))
+    os.makedirs(os.path.join(scene, SUBDIR), exist_ok=True)
+    for i, band in enumerate(bands):
+        path = os.path.join(scene, SUBDIR, BAND_FMT.format(band=band, **meta))
+        if not os.path.exists(path):
+            write_band(path, size, seed=int(date.timestamp()) + i)
+    return scene
+
+
+def make_rcm_dataset(
+    root: str, nscenes: int, size: int, bands: list[str] = ["HH", "HV", "iae"]
+) -> list[str]:
+    start = dt(2023, 4, 1, 10, 20, 30)
+    return [
+        make_rcm_scene(root, start + timedelta(days=12 * i), size, bands)
+        for i in range(nscenes)
+    ]
+
+
+def aoi_for_size(size: int, frac: float = 0.05) -> list[list[float]]:
+    """Square aoi in the middle of the scene covering frac of its width."""
+    half = size * RES * frac / 2
+    cx = ORIGIN[0] + size * RES / 2
+    cy = ORIGIN[1] - size * RES / 2
+    return [
+        [cx - half, cy + half],
+        [cx + half, cy + half],
+        [cx + half, cy - half],
+        [cx - half, cy - half],
+        [cx - half, cy + half],
+    ]
@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from datamodules.utils import (
+    bounds_to_window,
+    create_gdf_from_coords,
+    mask_window,
+    rasterize_aoi,
+)
+
+if TYPE_CHECKING:
+    import xarray as xr
+
+
+class AOIManager:
+    """Builds the aoi geometry once and caches its masks on each raster grid.
+
+    The geometry is only built when first needed. Masks are keyed by (crs,
+    transform, shape), so scenes that share a grid (same beam mode) rasterise
+    the aoi only once. Only the mask cropped to the aoi window is kept, for the
+    max_grids most recently used grids. The cache lives in each process, with
+    the process executor every task gets its own copy of the manager so masks
+    are not shared between scenes and the hit counts of the main process stay
+    empty.
+    """
+
+    def __init__(
+        self, coords: list, crs: str = "EPSG:4326", max_grids: int = 32
+    ) -> None:
+        self.coords = coords
+        self.crs = crs
+        self.max_grids = max_grids
+        self._geodf = None
+        self._geoms = {}
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self) -> dict:
+        # locks cannot be pickled, each worker process makes its own
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def geodf(self):
+        if self._geodf is None:
+            self._geodf = create_gdf_from_coords(self.coords, crs=self.crs)
+        return self._geodf
+
+    def geoms(self, crs) -> np.ndarray:
+        """Aoi geometries reprojected to crs."""
+        key = str(crs)
+        with self._lock:
+            if key not in self._geoms:
+                self._geoms[key] = self.geodf.to_crs(crs).geometry.values
+            return self._geoms[key]
+
+    def bounds(self, crs) -> list[float]:
+        """Bounds of the aoi [minx, miny, maxx, maxy] in crs."""
+        bounds = np.array([geom.bounds for geom in self.geoms(crs)])
+        return list(bounds[:, :2].min(axis=0)) + list(bounds[:, 2:].max(axis=0))
+
+    def mask(self, band: "xr.DataArray") -> tuple:
+        """Mask of the aoi on the grid of band, cropped to the window holding it.
+
+        Returns (mask, window), or (None, None) if the aoi does not intersect
+        the band. Only the pixels around the aoi bounds are rasterised.
+        """
+        transform = band.rio.transform()
+        shape = band.rio.shape
+        key = (str(band.rio.crs), tuple(transform), shape)
+        with self._lock:
+            if key in self._masks:
+                self.hits += 1
+                self._masks.move_to_end(key)
+                return self._masks[key]
+            self.misses += 1
+        entry = (None, None)
+        window = self.window(band)
+        if window is not None:
+            rows, cols = window
+            mask = rasterize_aoi(
+                self.geoms(band.rio.crs),
+                transform * transform.translation(cols.start, rows.start),
+                (rows.stop - rows.start, cols.stop - cols.start),
+            )
+            window = mask_window(mask)
+            if window is not None:
+                entry = (
+                    mask[window],
+                    (
+                        slice(
+                            rows.start + window[0].start, rows.start + window[0].stop
+                        ),
+                        slice(
+                            cols.start + window[1].start, cols.start + window[1].stop
+                        ),
+                    ),
+                )
+        with self._lock:
+            self._masks[key] = entry
+            while len(self._masks) > self.max_grids:
+                self._masks.popitem(last=False)
+        return entry
+
+    def window(self, band: "xr.DataArray") -> tuple:
+        """Pixel window of band around the aoi bounds, None if they do not overlap."""
+        rows, cols = bounds_to_window(
+            self.bounds(band.rio.crs), band.rio.transform(), band.rio.shape
+        )
+        if rows.stop <= rows.start or cols.stop <= cols.start:
+            return None
+        return rows, cols
+
+    def clip(self, band: "xr.DataArray") -> tuple:
+        """Crop band to the aoi window, returns (band, mask) or (None, None)."""
+        mask, window = self.mask(band)
+        if window is None:
+            return None, None
+        return band.isel(y=window[0], x=window[1]), mask
+
+    def stats(self) -> dict:
+        return {"grids": len(self._masks), "hits": self.hits, "misses": self.misses}
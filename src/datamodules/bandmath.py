@@ -0,0 +1,114 @@
+import ast
+
+import numpy as np
+
+# functions allowed in band expressions, numexpr and numpy share their names
+FUNCTIONS = [
+    "abs",
+    "arccos",
+    "arcsin",
+    "arctan",
+    "arctan2",
+    "cos",
+    "cosh",
+    "exp",
+    "log",
+    "log10",
+    "log1p",
+    "sin",
+    "sinh",
+    "sqrt",
+    "tan",
+    "tanh",
+    "where",
+]
+NODES = (
+    ast.Expression,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.Compare,
+    ast.Call,
+    ast.Name,
+    ast.Constant,
+    ast.Load,
+    ast.operator,
+    ast.unaryop,
+    ast.cmpop,
+)
+
+
+class BandExpr:
+    """A derived band given by an element-wise expression of other bands.
+
+    The expression (e.g. "HH - HV" or "(s1**2 + s2**2 + s3**2)**0.5 / s0") is
+    parsed and checked once, with band names as variables. It is evaluated in
+    blocks of rows, with numexpr if it is installed, which fuses the operations
+    so there are no temporary arrays, otherwise with numpy on each block so
+    temporaries are only the size of a block.
+    """
+
+    def __init__(self, name: str, expr: str) -> None:
+        self.name = name
+        self.expr = expr
+        self.inputs = []
+        tree = ast.parse(expr, mode="eval")
+        for node in ast.walk(tree):
+            if not isinstance(node, NODES):
+                raise Exception(f"{type(node).__name__} not allowed in band {name}")
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+                    raise Exception(f"functions in band {name} can be: {FUNCTIONS}")
+            elif isinstance(node, ast.Name) and node.id not in FUNCTIONS:
+                if node.id not in self.inputs:
+                    self.inputs.append(node.id)
+        if len(self.inputs) == 0:
+            raise Exception(f"band {name} does not use any band")
+        self.code = compile(tree, f"<band {name}>", "eval")
+
+    def __getstate__(self) -> dict:
+        # code objects cannot be pickled, each worker process compiles its own
+        state = self.__dict__.copy()
+        del state["code"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.code = compile(self.expr, f"<band {self.name}>", "eval")
+
+    def evaluate(self, bands: dict, rows: int = 1024) -> np.ndarray:
+        """Evaluate on a dict of band arrays, returns a float32 array."""
+        try:
+            import numexpr
+        except ImportError:
+            numexpr = None
+
+        missing = [bname for bname in self.inputs if bname not in bands]
+        if missing:
+            raise Exception(f"band {self.name} needs missing bands: {missing}")
+        arrs = {bname: bands[bname] for bname in self.inputs}
+        shapes = {arr.shape for arr in arrs.values()}
+        if len(shapes) > 1:
+            raise Exception(f"bands of {self.name} have different shapes: {shapes}")
+        shape = shapes.pop()
+        out = np.empty(shape, dtype=np.float32)
+        funcs = {func: getattr(np, func) for func in FUNCTIONS}
+        for row in range(0, max(shape[0], 1), rows):
+            blk = {bname: arr[row : row + rows] for bname, arr in arrs.items()}
+            if numexpr is not None:
+                numexpr.evaluate(
+                    self.expr,
+                    local_dict=blk,
+                    out=out[row : row + rows],
+                    casting="same_kind",
+                )
+                continue
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out[row : row + rows] = eval(
+                    self.code, {"__builtins__": {}, **funcs}, blk
+                )
+        return out
+
+
+def compile_exprs(band_exprs: dict) -> list[BandExpr]:
+    """BandExpr for each name: expression of the config, in config order."""
+    return [BandExpr(name, expr) for name, expr in (band_exprs or {}).items()]
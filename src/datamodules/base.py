@@ -1,6 +1,14 @@
 from omegaconf import OmegaConf
 
-from datamodules.utils import checkdir, get_filelist
+from datamodules.aoi import AOIManager
+from datamodules.utils import checkdir, get_filelist, save_fig
+
+
+def to_container(cfg):
+    """Plain python copy of a config node, other values are returned as is."""
+    if OmegaConf.is_config(cfg):
+        return OmegaConf.to_container(cfg, resolve=True)
+    return cfg
 
 
 class Product:
@@ -10,6 +18,8 @@ class Product:
         for meta in self.metalist:
             self.metadict[meta] = None
         self.bands = {}
+        # files written for this product, recorded in the run manifest
+        self.outputs = []
 
     def get_band(self, bname: str):
         """Get band data."""
@@ -28,6 +38,8 @@ class Datamod:
         edt: str = None,
         aoi: str = None,
         aoi_crs: str = "EPSG:4326",
+        aois: dict = None,
+        stations: dict = None,
         lims_for_plotting: dict = None,
         **kwargs,
     ) -> None:
@@ -35,14 +47,25 @@ class Datamod:
         if dir is not None:
             self.filelist = get_filelist(dir, files, ext)
             print(f"number of files: {len(self.filelist)}")
-        self.aoi = OmegaConf.to_container(aoi)
+        self.aoi = to_container(aoi)
         self.aoi_crs = aoi_crs
+        self.aoi_manager = AOIManager(self.aoi, aoi_crs)
+        # named polygons and station points, all clipped from each scene read
+        self.regions = {}
+        for name, coords in (to_container(aois) or {}).items():
+            self.regions[name] = AOIManager(coords, aoi_crs)
+        for name, coords in (to_container(stations) or {}).items():
+            self.regions[name] = AOIManager(coords, aoi_crs)
         self.outdir = outdir
         self.lims_for_plotting = lims_for_plotting
         self.sdt = sdt
         self.edt = edt
         checkdir(self.outdir)
 
+    def prefetch(self, files: list[str]) -> None:
+        """Read each of files ahead while the one before it is processed."""
+        pass
+
     def read_file(self, file: str, **kwargs) -> Product:
         """Read file and return a Product object."""
         pass
@@ -51,6 +74,10 @@ class Datamod:
         """Select a subset from an image given some input geometry."""
         pass
 
+    def bandmath(self, prod: Product, **kwargs) -> None:
+        """Add bands derived from the other bands."""
+        pass
+
     def plot(self, prod: Product, **kwargs) -> None:
         """Plot data."""
         pass
@@ -58,3 +85,65 @@ class Datamod:
     def save(self, prod: Product, **kwargs) -> None:
         """Save data."""
         pass
+
+    def summarise(self, prod: Product) -> list[dict]:
+        """Reduce a product to timeseries rows."""
+        return []
+
+    def timeseries(self, **kwargs) -> None:
+        """Collect and save a timeseries."""
+        pass
+
+    def write_timeseries(self) -> None:
+        """Save the rows in self.accumulator as plots, zarr stores and a table.
+
+        The main aoi is saved as timeseries and each named region as
+        timeseries_<region>, with one tidy table of all of them.
+        """
+        from datamodules.store import save_table
+
+        for region in [None] + self.accumulator.regions:
+            name = "timeseries" if region is None else f"timeseries_{region}"
+            timeseriesdict = self.accumulator.to_dict(region)
+            if len(timeseriesdict) > 0:
+                self.save_timeseries(timeseriesdict, name)
+        savetab = save_table(self.accumulator.to_table(), self.outdir + "timeseries")
+        print(f"saved time series table to: {savetab}")
+
+    def save_timeseries(self, timeseriesdict: dict, name: str) -> None:
+        import matplotlib.pyplot as plt
+        from matplotlib.dates import DateFormatter, date2num
+
+        from datamodules.store import STORE_EXT, save_timeseries
+
+        metas = self.accumulator.metas
+        bands = [band for band in self.accumulator.bands if band in timeseriesdict]
+
+        dn = date2num(timeseriesdict["datetime"])
+        plt.rcParams.update({"font.family": "Times New Roman", "font.size": 7})
+        _, ax = plt.subplots(
+            len(bands), 1, figsize=(4, 2.5 * len(bands)), squeeze=False
+        )
+        plt.subplots_adjust(
+            left=0.07, bottom=0.07, right=0.93, top=0.93, wspace=0.01, hspace=0.3
+        )
+        dformat = DateFormatter("%y-%m-%d")
+        for i, band in enumerate(bands):
+            ax[i, 0].plot_date(dn, timeseriesdict[band])
+            ax[i, 0].set_title(band)
+            ax[i, 0].xaxis.set_major_formatter(dformat)
+        figt = self.outdir + name + ".png"
+        save_fig(figt)
+        plt.close()
+        print(f"saved plot to: {figt} \n \n")
+
+        savets = self.outdir + name + STORE_EXT
+        save_timeseries(timeseriesdict, metas, savets)
+        print(f"saved time series data to: {savets}")
+
+    def report(self) -> None:
+        """Print a summary at the end of a run."""
+        for name, manager in [("aoi", self.aoi_manager)] + list(self.regions.items()):
+            stats = manager.stats()
+            if stats["grids"] > 0:
+                print(f"{name} masks: {stats}")
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from datamodules.utils import checkdir, pload, psave
+
+CACHE_MODES = ["off", "read", "write", "readwrite"]
+
+
+def make_key(*parts) -> str:
+    """Hash any json serialisable parts into a cache key."""
+    keystr = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(keystr.encode()).hexdigest()
+
+
+def path_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            size += os.path.getsize(os.path.join(root, file))
+    return size
+
+
+class DiskCache:
+    """Size capped on-disk cache with least recently used eviction.
+
+    Entries are stored one per key under cachedir. The modification time of an
+    entry is refreshed whenever it is read, so the oldest entries are the least
+    recently used ones and are evicted first once max_size_mb is exceeded.
+    """
+
+    ext = ".pkl"
+    modes = CACHE_MODES
+
+    def __init__(
+        self, cachedir: str, mode: str = "readwrite", max_size_mb: float = 2048
+    ) -> None:
+        if mode in [None, False]:
+            mode = "off"
+        if mode not in self.modes:
+            raise Exception(f"cache mode should be one of: {self.modes}")
+        self.mode = mode
+        self.cachedir = cachedir
+        self.max_size = max_size_mb * 1e6
+        if self.mode != "off":
+            checkdir(self.cachedir)
+
+    @property
+    def can_read(self) -> bool:
+        return self.mode in ["read", "readwrite"]
+
+    @property
+    def can_write(self) -> bool:
+        return self.mode in ["write", "readwrite"]
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cachedir, key + self.ext)
+
+    def dump(self, obj, path: str) -> None:
+        psave(obj, path)
+
+    def load(self, path: str):
+        return pload(path)
+
+    def get(self, key: str):
+        """Return the cached object, or None if missing or not reading."""
+        if not self.can_read:
+            return None
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            obj = self.load(path)
+        except Exception as e:
+            print(e)
+            print(f"could not load cache entry: {path}")
+            return None
+        os.utime(path)
+        return obj
+
+    def put(self, key: str, obj) -> None:
+        if not self.can_write:
+            return
+        path = self.path(key)
+        # write to a temporary name first so readers never see partial entries
+        tmp = path + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        self.dump(obj, tmp)
+        self.remove(path)
+        os.replace(tmp, path)
+        self.evict()
+
+    def remove(self, path: str) -> None:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def entries(self) -> list[tuple]:
+        """List (mtime, size, path) for each entry, oldest first."""
+        entries = []
+        for entry in os.scandir(self.cachedir):
+            if not entry.name.endswith(self.ext):
+                continue
+            try:
+                entries.append(
+                    (entry.stat().st_mtime, path_size(entry.path), entry.path)
+                )
+            except FileNotFoundError:
+                # removed by another worker
+                continue
+        return sorted(entries)
+
+    def evict(self) -> None:
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            self.remove(path)
+            total -= size
+            print(f"evicted cache entry: {path}")
@@ -0,0 +1,143 @@
+import os
+import sqlite3
+from datetime import datetime as dt
+
+from datamodules.utils import (
+    checkdir,
+    list_band_files,
+    parse_band_name,
+    parse_scene_meta,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    path TEXT PRIMARY KEY,
+    datetime TEXT NOT NULL,
+    sat TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    path TEXT NOT NULL REFERENCES scenes(path) ON DELETE CASCADE,
+    band TEXT NOT NULL,
+    PRIMARY KEY (path, band)
+);
+CREATE INDEX IF NOT EXISTS scenes_datetime ON scenes (datetime);
+"""
+
+
+def to_isoformat(date) -> str:
+    """Date from the config (string or date) as an iso string for sql compares."""
+    if date is None:
+        return None
+    return dt.fromisoformat(str(date)).isoformat()
+
+
+class SceneCatalog:
+    """SQLite index of the scenes in a directory, from their file names only.
+
+    The datetime, satellite and beam mode of each scene are parsed with the
+    meta_map rules and its bands are listed from subdir, so scenes can be
+    selected without opening any raster. Updating only parses scenes that are
+    new or whose band directory changed since they were indexed, and drops the
+    ones that are gone.
+    """
+
+    def __init__(
+        self, path: str, meta_map: dict, subdir: str = "", ext: str = ""
+    ) -> None:
+        self.path = path
+        self.meta_map = meta_map
+        self.subdir = subdir
+        self.ext = ext or ""
+        checkdir(os.path.dirname(path) or ".")
+        self.con = sqlite3.connect(path)
+        self.con.execute("PRAGMA foreign_keys = ON")
+        self.con.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.con.close()
+
+    def banddir(self, scene: str) -> str:
+        return scene + "/" + self.subdir
+
+    def update(self, dir: str) -> dict:
+        """Index new and changed scenes in dir, returns counts of what changed."""
+        known = dict(self.con.execute("SELECT path, mtime FROM scenes"))
+        seen = set()
+        added, failed = 0, 0
+        with self.con:
+            for entry in os.scandir(dir):
+                if entry.name.startswith(".") or not entry.name.endswith(self.ext):
+                    continue
+                if not entry.is_dir():
+                    continue
+                # same path string as the glob used without a catalog
+                scene = dir + entry.name
+                seen.add(scene)
+                try:
+                    mtime = os.path.getmtime(self.banddir(scene))
+                except OSError:
+                    failed += 1
+                    continue
+                if known.get(scene) == mtime:
+                    continue
+                try:
+                    self.add(scene, mtime)
+                    added += 1
+                except Exception as e:
+                    print(e)
+                    print(f"could not index scene: {scene}")
+                    failed += 1
+            gone = [(path,) for path in known if path not in seen]
+            self.con.executemany("DELETE FROM scenes WHERE path = ?", gone)
+        return {
+            "scenes": len(seen),
+            "added": added,
+            "removed": len(gone),
+            "failed": failed,
+        }
+
+    def add(self, scene: str, mtime: float) -> None:
+        meta = parse_scene_meta(scene, self.meta_map)
+        bands = {
+            parse_band_name(file, self.meta_map)
+            for file in list_band_files(self.banddir(scene))
+        }
+        self.con.execute(
+            "INSERT OR REPLACE INTO scenes VALUES (?, ?, ?, ?, ?)",
+            (scene, meta["datetime"].isoformat(), meta["sat"], meta["mode"], mtime),
+        )
+        self.con.execute("DELETE FROM bands WHERE path = ?", (scene,))
+        self.con.executemany(
+            "INSERT INTO bands VALUES (?, ?)", [(scene, band) for band in bands]
+        )
+
+    def select(
+        self,
+        sdt: str = None,
+        edt: str = None,
+        sats: list[str] = None,
+        modes: list[str] = None,
+        bands: list[str] = None,
+    ) -> list[str]:
+        """Scenes from sdt (inclusive) to edt (exclusive), with one of sats and
+        modes and all of bands, in time order. None means no filter.
+        """
+        query = "SELECT path FROM scenes WHERE 1"
+        params = []
+        if sdt is not None:
+            query += " AND datetime >= ?"
+            params.append(to_isoformat(sdt))
+        if edt is not None:
+            query += " AND datetime < ?"
+            params.append(to_isoformat(edt))
+        for col, values in [("sat", sats), ("mode", modes)]:
+            if values is not None:
+                query += f" AND {col} IN ({','.join('?' * len(values))})"
+                params += list(values)
+        for band in bands or []:
+            query += " AND path IN (SELECT path FROM bands WHERE band = ?)"
+            params.append(band)
+        query += " ORDER BY datetime"
+        return [row[0] for row in self.con.execute(query, params)]
@@ -0,0 +1,209 @@
+import numpy as np
+
+from datamodules.store import open_band
+from datamodules.utils import checkdir
+
+# scale of the median absolute deviation to the std of a normal distribution
+MAD_SCALE = 1.4826
+
+
+def nan_percentiles(arr: np.ndarray, qs: list[float]) -> np.ndarray:
+    """Percentiles over the last axis ignoring nan, shape (len(qs), ...).
+
+    Same linear interpolation as np.percentile, but done with one sort of the
+    whole array (nan sorts last) instead of a python loop over each row like
+    np.nanpercentile.
+    """
+    srt = np.sort(arr, axis=-1)
+    count = np.sum(~np.isnan(arr), axis=-1)
+    pos = (count[..., np.newaxis] - 1) * (np.asarray(qs, dtype=float) / 100)
+    pos = np.clip(pos, 0, None)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, np.maximum(count[..., np.newaxis] - 1, 0))
+    vlo = np.take_along_axis(srt, lo, axis=-1)
+    vhi = np.take_along_axis(srt, hi, axis=-1)
+    out = vlo + (vhi - vlo) * (pos - lo)
+    out[count == 0] = np.nan
+    return np.moveaxis(out, -1, 0)
+
+
+def reduce_pixels(
+    arr: np.ndarray, stats: list[str] = [], percentiles: list[float] = []
+) -> dict:
+    """Statistics over the last axis of arr ignoring nan, keyed by stat name.
+
+    The median is always included, percentiles are keyed as p<q> and the
+    other stats can be mean, std, count and mad (scaled median absolute
+    deviation).
+    """
+    pvals = nan_percentiles(arr, [50] + list(percentiles))
+    out = {"median": pvals[0]}
+    for q, pval in zip(percentiles, pvals[1:]):
+        out[f"p{q:g}"] = pval
+    count = np.sum(~np.isnan(arr), axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if "mean" in stats or "std" in stats:
+            mean = np.nansum(arr, axis=-1, dtype=np.float64) / count
+        if "mean" in stats:
+            out["mean"] = mean
+        if "std" in stats:
+            sq = np.nansum((arr - mean[..., np.newaxis]) ** 2, axis=-1)
+            out["std"] = np.sqrt(sq / count)
+        if "mad" in stats:
+            dev = np.abs(arr - pvals[0][..., np.newaxis])
+            out["mad"] = MAD_SCALE * nan_percentiles(dev, [50])[0]
+    if "count" in stats:
+        out["count"] = count
+    return out
+
+
+class SceneStack:
+    """Per-scene stores of clipped bands seen as a (time, band, y, x) cube.
+
+    Nothing is read until a block is asked for, so the cube can be much bigger
+    than memory as long as a block of scenes (or a window of them) fits. All
+    stores have to be on the same grid.
+    """
+
+    def __init__(self, stores: list[str], bands: list[str]) -> None:
+        self.stores = list(stores)
+        self.bands = list(bands)
+        self.shape = None
+        self.grid = None
+        grids = {band_grid(store, self.bands[0]) for store in self.stores}
+        if len(grids) > 1:
+            raise Exception("stores of a stack must share a grid, see group_by_grid")
+        if grids:
+            self.grid = grids.pop()
+            self.shape = (len(self.stores), len(self.bands)) + self.grid[2]
+
+    def __len__(self) -> int:
+        return len(self.stores)
+
+    def read(self, t0: int, t1: int, window: tuple = None) -> np.ndarray:
+        """Scenes t0 to t1 as a float32 (time, band, y, x) array.
+
+        window is an optional (row slice, col slice) of the grid.
+        """
+        window = window or (slice(None), slice(None))
+        stores = self.stores[t0:t1]
+        arr = None
+        for i, store in enumerate(stores):
+            for j, bname in enumerate(self.bands):
+                band = open_band(store, bname).isel(y=window[0], x=window[1])
+                if arr is None:
+                    shape = (len(stores), len(self.bands)) + band.shape
+                    arr = np.empty(shape, dtype=np.float32)
+                arr[i, j] = band.values
+        return arr
+
+    def blocks(self, block: int = 16, window: tuple = None):
+        """Yield (t0, array) for blocks of up to block scenes."""
+        for t0 in range(0, len(self.stores), block):
+            yield t0, self.read(t0, t0 + block, window)
+
+    def reduce(
+        self, stats: list[str] = [], percentiles: list[float] = [], block: int = 16
+    ) -> dict:
+        """Spatial statistics of each scene and band, arrays of shape (time, band).
+
+        Each block of scenes is reduced over y, x in one vectorised call.
+        """
+        out = {}
+        for t0, arr in self.blocks(block):
+            flat = arr.reshape(arr.shape[:2] + (-1,))
+            for stat, values in reduce_pixels(flat, stats, percentiles).items():
+                if stat not in out:
+                    out[stat] = np.empty((len(self), len(self.bands)), values.dtype)
+                out[stat][t0 : t0 + len(arr)] = values
+        return out
+
+
+def band_grid(store: str, band: str) -> tuple:
+    """(crs, transform, shape) of a band in a store."""
+    rxt = open_band(store, band)
+    return str(rxt.rio.crs), tuple(rxt.rio.transform()), rxt.shape
+
+
+def group_by_grid(stores: list[str], band: str) -> dict[tuple, list[int]]:
+    """Indices of the stores on each (crs, transform, shape) grid, so each
+    group stacks pixel for pixel."""
+    groups = {}
+    for i, store in enumerate(stores):
+        groups.setdefault(band_grid(store, band), []).append(i)
+    return groups
+
+
+def write_temporal(
+    stack: SceneStack,
+    outdir: str,
+    times: list,
+    percentiles: list[float] = [],
+    rows: int = 256,
+    db_bands: list[str] = [],
+) -> list[str]:
+    """Per-pixel temporal statistics and change maps of a stack as GeoTIFFs.
+
+    For each band <band>_stats.tif holds the mean, std, median, percentiles and
+    coefficient of variation over time, and <band>_change.tif the log ratio in
+    dB between consecutive scenes. Bands in db_bands are already in dB, their
+    cv is taken on the linear power and their log ratio is a difference. The
+    grid is read in strips of rows, so memory depends on the number of scenes
+    times the strip size and not on the full stack.
+    """
+    import rasterio
+    from affine import Affine
+    from rasterio.windows import Window
+
+    checkdir(outdir)
+    crs, transform, (height, width) = stack.grid
+    profile = dict(
+        driver="GTiff",
+        height=height,
+        width=width,
+        dtype="float32",
+        crs=crs,
+        transform=Affine(*transform[:6]),
+        nodata=np.nan,
+        tiled=True,
+        compress="deflate",
+    )
+    names = ["mean", "std", "median"] + [f"p{q:g}" for q in percentiles] + ["cv"]
+    pairs = [f"{t0:%Y%m%d}_{t1:%Y%m%d}" for t0, t1 in zip(times[:-1], times[1:])]
+    files, dsts = [], {}
+    for bname in stack.bands:
+        layers = {"stats": names, "change": pairs}
+        for kind, descriptions in layers.items():
+            if len(descriptions) == 0:
+                continue
+            path = f"{outdir}{bname}_{kind}.tif"
+            dst = rasterio.open(path, "w", count=len(descriptions), **profile)
+            for i, desc in enumerate(descriptions):
+                dst.set_band_description(i + 1, desc)
+            dsts[(bname, kind)] = dst
+            files.append(path)
+    try:
+        for r0 in range(0, height, rows):
+            arr = stack.read(0, len(stack), (slice(r0, r0 + rows), slice(None)))
+            window = Window(0, r0, width, arr.shape[2])
+            for j, bname in enumerate(stack.bands):
+                data = arr[:, j]
+                tstats = reduce_pixels(
+                    np.moveaxis(data, 0, -1), ["mean", "std"], percentiles
+                )
+                lin = 10 ** (data / 10) if bname in db_bands else data
+                linstats = reduce_pixels(np.moveaxis(lin, 0, -1), ["mean", "std"])
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    tstats["cv"] = linstats["std"] / linstats["mean"]
+                    if bname in db_bands:
+                        change = data[1:] - data[:-1]
+                    else:
+                        change = 10 * np.log10(data[1:] / data[:-1])
+                out = np.stack([tstats[name] for name in names]).astype(np.float32)
+                dsts[(bname, "stats")].write(out, window=window)
+                if (bname, "change") in dsts:
+                    dsts[(bname, "change")].write(change, window=window)
+    finally:
+        for dst in dsts.values():
+            dst.close()
+    return files
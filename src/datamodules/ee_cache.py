@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+
+from datamodules.cache import CACHE_MODES, DiskCache
+
+
+class EECache(DiskCache):
+    """On-disk cache of earth engine responses, stored as json.
+
+    Entries can expire after ttl seconds (e.g. collection searches that change
+    as new images are added) or never (e.g. pixels of archived images). In
+    offline mode every response has to come from the cache, expired or not,
+    and a missing one is an error instead of a request.
+    """
+
+    ext = ".json"
+    modes = CACHE_MODES + ["offline"]
+
+    def __init__(
+        self, cachedir: str, mode: str = "readwrite", max_size_mb: float = 1024
+    ) -> None:
+        if mode == "offline" and (cachedir is None or not os.path.isdir(cachedir)):
+            raise Exception(
+                f"offline mode needs an earth engine cache, {cachedir} does not exist"
+            )
+        super().__init__(cachedir, mode=mode, max_size_mb=max_size_mb)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @property
+    def can_read(self) -> bool:
+        return self.mode in ["read", "readwrite", "offline"]
+
+    def dump(self, obj, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(obj, f)
+
+    def load(self, path: str):
+        with open(path) as f:
+            return json.load(f)
+
+    def get(self, key: str):
+        entry = super().get(key)
+        if entry is None:
+            return None
+        expired = entry["expires"] is not None and entry["expires"] < time.time()
+        if expired and self.mode != "offline":
+            self.remove(self.path(key))
+            return None
+        return entry["value"]
+
+    def put(self, key: str, value, ttl: float = None) -> None:
+        expires = None if ttl is None else time.time() + ttl
+        super().put(key, {"expires": expires, "value": value})
+
+    def fetch(self, key: str, fn, ttl: float = None):
+        """Cached response for key, or fn() stored for ttl seconds (None: forever)."""
+        value = self.get(key)
+        with self.lock:
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+        if self.mode == "offline":
+            raise Exception(f"response {key} is not in the earth engine cache")
+        value = fn()
+        self.put(key, value, ttl)
+        return value
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+_cache = EECache(None, mode="off")
+
+
+def get_ee_cache() -> EECache:
+    return _cache
+
+
+def set_ee_cache(cache: EECache) -> None:
+    global _cache
+    _cache = cache
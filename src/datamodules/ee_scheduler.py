@@ -0,0 +1,207 @@
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
+
+import numpy as np
+
+# network errors worth retrying, requests is used by the earth engine client
+NETWORK_ERRORS = (ConnectionError, TimeoutError, socket.timeout, HTTPException)
+try:
+    from requests.exceptions import ConnectionError as RequestsConnectionError
+    from requests.exceptions import Timeout
+
+    NETWORK_ERRORS += (RequestsConnectionError, Timeout)
+except ImportError:
+    pass
+
+
+def http_status(err: Exception) -> int:
+    """HTTP status of an error from the api client, None if it has none."""
+    for status in [
+        getattr(err, "status_code", None),
+        getattr(err, "code", None),
+        getattr(getattr(err, "resp", None), "status", None),
+        getattr(getattr(err, "response", None), "status_code", None),
+    ]:
+        try:
+            return int(status)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def is_retryable(err: Exception) -> bool:
+    """Retry rate limits (429), server errors (5xx) and network errors.
+
+    The earth engine client raises EEException while handling the HttpError of
+    the api client, so the errors it was raised from are checked too. Errors in
+    the request itself (e.g. user memory limit exceeded) are not retried.
+    """
+    seen = set()
+    while err is not None and id(err) not in seen:
+        seen.add(id(err))
+        if isinstance(err, NETWORK_ERRORS):
+            return True
+        status = http_status(err)
+        if status is not None and (status == 429 or status >= 500):
+            return True
+        err = err.__cause__ or err.__context__
+    return False
+
+
+class TokenBucket:
+    """Allow rate calls per second on average, with bursts of up to burst calls."""
+
+    def __init__(self, rate: float = 10.0, burst: int = 10) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate is None or self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.last) * self.rate
+                )
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+class RequestScheduler:
+    """Send earth engine requests with bounded concurrency, rate limits and retries.
+
+    At most max_workers requests are in flight at once (also across scenes run
+    in threads), requests are rate limited by a token bucket and quota or
+    transient errors are retried with exponential backoff and jitter.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        rate: float = 10.0,
+        burst: int = 10,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ) -> None:
+        self.max_workers = max(1, max_workers)
+        self.semaphore = threading.BoundedSemaphore(self.max_workers)
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool = None
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.nretries = 0
+        self.nerrors = 0
+
+    def __getstate__(self) -> dict:
+        # a copy sent to a worker process gets its own locks and thread pool
+        state = self.__dict__.copy()
+        for key in ["semaphore", "lock", "pool"]:
+            del state[key]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.semaphore = threading.BoundedSemaphore(self.max_workers)
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def record(self, name: str, latency: float) -> None:
+        with self.lock:
+            self.latencies.setdefault(name, []).append(latency)
+
+    def call(self, fn, *args, name: str = None, **kwargs):
+        """Run fn(*args, **kwargs) under the scheduler limits, retrying if needed."""
+        name = name or getattr(fn, "__name__", "call")
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            with self.semaphore:
+                t0 = time.perf_counter()
+                try:
+                    out = fn(*args, **kwargs)
+                    self.record(name, time.perf_counter() - t0)
+                    return out
+                except Exception as e:
+                    self.record(name, time.perf_counter() - t0)
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        with self.lock:
+                            self.nerrors += 1
+                        raise
+                    err = e
+            wait = min(self.max_backoff, self.backoff * 2**attempt)
+            wait *= 0.5 + random.random() / 2
+            print(f"{name} failed ({err}), retrying in {wait:.1f} s")
+            with self.lock:
+                self.nretries += 1
+            attempt += 1
+            time.sleep(wait)
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule a call from the thread pool and return a future."""
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self.pool.submit(self.call, fn, *args, **kwargs)
+
+    def map(self, fn, items: list, name: str = None) -> list:
+        """Call fn on each item concurrently, results in the order of items."""
+        futures = [self.submit(fn, item, name=name) for item in items]
+        return [future.result() for future in futures]
+
+    def getinfo(self, obj):
+        return self.call(obj.getInfo, name="getInfo")
+
+    def metrics(self) -> dict:
+        """Number of calls and latency percentiles (s) per request type."""
+        out = {"nretries": self.nretries, "nerrors": self.nerrors, "calls": {}}
+        with self.lock:
+            for name, lats in self.latencies.items():
+                out["calls"][name] = {
+                    "n": len(lats),
+                    "total": float(np.sum(lats)),
+                    "p50": float(np.percentile(lats, 50)),
+                    "p95": float(np.percentile(lats, 95)),
+                    "max": float(np.max(lats)),
+                }
+        return out
+
+    def ncalls(self) -> int:
+        with self.lock:
+            return sum(len(lats) for lats in self.latencies.values())
+
+
+_scheduler = RequestScheduler()
+
+
+def get_scheduler() -> RequestScheduler:
+    return _scheduler
+
+
+def set_scheduler(scheduler: RequestScheduler) -> None:
+    global _scheduler
+    _scheduler = scheduler
@@ -2,45 +2,94 @@ import webbrowser
 from pathlib import Path
 
 import ee
-import folium
-import matplotlib.pyplot as plt
 import numpy as np
 
 from datamodules.base import Datamod, Product
+from datamodules.cache import make_key
+from datamodules.ee_cache import EECache, get_ee_cache, set_ee_cache
+from datamodules.ee_scheduler import RequestScheduler, set_scheduler
 from datamodules.gee_utils import (
     add_ee_layer,
     aoi2eegeo,
     auth,
     basemaps,
-    dist_coords,
+    collection_info,
     ee2pydt,
+    fetch_features,
+    getinfo,
     init,
+    millis2pydt,
+    stat_names,
+    stats_reducer,
     stringdt2eedt,
 )
-from datamodules.utils import save_fig
+from datamodules.timeseries import TimeseriesAccumulator, stat_key
+from datamodules.utils import PixelLocator, hash_aoi, save_fig
+
+TS_MODES = ["scene", "collection"]
 
 
 class GEEProdS1(Product):
-    def __init__(self, file: str, **kwargs) -> None:
+    def __init__(
+        self, file: str, info: dict = None, ee_cache: EECache = None, **kwargs
+    ) -> None:
         super().__init__(**kwargs)
-        img = ee.Image(file)
-        self.metadict["datetime"] = ee2pydt(img.date())
-        # self.datetime = ee2pydt(img.date())
-        self.bands = img.bandNames().getInfo()
-        self.metadata = img.getInfo()
+        self.id = file
+        self.ee_cache = ee_cache if ee_cache is not None else get_ee_cache()
+        self._img = None
+        if info is not None:
+            # metadata already fetched for the whole collection
+            self.metadict["datetime"] = millis2pydt(info["millis"])
+            self.bands = info["bands"]
+            self.metadata = info["props"]
+        else:
+            self.metadict["datetime"] = ee2pydt(self.img.date())
+            # self.datetime = ee2pydt(img.date())
+            self.bands = getinfo(self.img.bandNames())
+            self.metadata = getinfo(self.img)
+        self.pixels = None
+        self.pixel_key = None
+        self.sample_aoi = None
         str_meta = Path(file).name.split("_")
         self.metadict["sat"] = str_meta[0]
         self.metadict["mode"] = str_meta[1]
-        self.img = img
+
+    @property
+    def img(self) -> ee.Image:
+        # only built when a request is made, so cached products need no session
+        if self._img is None:
+            self._img = ee.Image(self.id)
+        return self._img
 
     def get_proj(self, img: ee.Image) -> ee.Image:
         return img.projection()
 
     def get_bnames(self, img: ee.Image) -> ee.Image:
-        return img.bandNames().getInfo()
+        return getinfo(img.bandNames())
+
+    def sample(self) -> ee.Feature:
+        """All bands and lon/lat on the grid of the first band in one rectangle."""
+        proj = self.get_proj(self.img.select(self.bands[0]))
+        return (
+            self.img.addBands(ee.Image.pixelLonLat())
+            .reproject(proj)
+            .unmask(0)
+            .sampleRectangle(aoi2eegeo(self.sample_aoi))
+        )
+
+    def get_pixels(self) -> dict:
+        """Fetch every band and lon/lat of the sampled rectangle in one request.
 
-    def get_band(self, feat: ee.feature.Feature, bname: str) -> np.array:
-        return np.array(feat.get(bname).getInfo())
+        Pixels of archived images do not change so they are cached for good.
+        """
+        if self.pixels is None:
+            self.pixels = self.ee_cache.fetch(
+                self.pixel_key, lambda: getinfo(self.sample())["properties"]
+            )
+        return self.pixels
+
+    def get_band(self, bname: str) -> np.array:
+        return np.array(self.get_pixels()[bname])
 
     def get_lonlat(self):
         # use this as guide:
@@ -50,18 +99,118 @@ class GEEProdS1(Product):
 
 
 class GEEDMS1(Datamod):
-    def __init__(self, **kwargs) -> None:
+    def __init__(
+        self,
+        stn_locator: str = "haversine",
+        ee_max_workers: int = 8,
+        ee_rate: float = 10.0,
+        ee_max_retries: int = 5,
+        ts_mode: str = "scene",
+        ts_bands: list[str] = ["VV", "VH"],
+        ts_stats: list[str] = ["mean", "count"],
+        ts_percentiles: list[float] = [],
+        ee_scale: float = 10,
+        ee_page_size: int = 5000,
+        ee_cache: str = "off",
+        ee_cache_dir: str = None,
+        ee_cache_size_mb: float = 1024,
+        ee_search_ttl_h: float = 24,
+        **kwargs,
+    ) -> None:
         super().__init__(**kwargs)
-        try:
-            init()
-        except Exception as e:
-            print(e)
-            print("trying to authenticate earth engine... \n \n")
-            auth()
-        self.aoi_ee = aoi2eegeo(self.aoi)
+        if ts_mode not in TS_MODES:
+            raise Exception(f"ts_mode should be one of: {TS_MODES}")
+        self.ts_mode = ts_mode
+        self.ts_bands = list(ts_bands)
+        self.ts_stats = list(ts_stats)
+        self.ts_percentiles = list(ts_percentiles)
+        self.stat_names = stat_names(ts_stats, ts_percentiles)
+        self.ee_scale = ee_scale
+        self.ee_page_size = ee_page_size
+        self.search_ttl = ee_search_ttl_h * 3600
+        self.accumulator = TimeseriesAccumulator(
+            stats=ts_stats, percentiles=ts_percentiles
+        )
+        self.locator = PixelLocator(stn_locator)
+        # kept on the datamodule so worker processes install the same limits
+        self.scheduler = RequestScheduler(
+            max_workers=ee_max_workers,
+            rate=ee_rate,
+            burst=ee_max_workers,
+            max_retries=ee_max_retries,
+        )
+        set_scheduler(self.scheduler)
+        self.ee_cache = EECache(
+            ee_cache_dir or self.outdir + "ee_cache/",
+            mode=ee_cache,
+            max_size_mb=ee_cache_size_mb,
+        )
+        set_ee_cache(self.ee_cache)
+        if self.ee_cache.mode != "offline":
+            try:
+                init()
+            except Exception as e:
+                print(e)
+                print("trying to authenticate earth engine... \n \n")
+                auth()
+        # ee objects are built when first used, see aoi_ee
+        self._aoi_ee = None
+        self._region_ee = None
+        self._reducer = None
         self.filelist = self.search_s1()
 
-    def search_s1(self):
+    def __getstate__(self) -> dict:
+        # ee objects are rebuilt in the worker
+        state = self.__dict__.copy()
+        state.update(_aoi_ee=None, _region_ee=None, _reducer=None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        # a worker process starts with the default scheduler and cache and no
+        # ee session
+        self.__dict__.update(state)
+        set_scheduler(self.scheduler)
+        set_ee_cache(self.ee_cache)
+        if self.ee_cache.mode != "offline":
+            init()
+
+    @property
+    def aoi_ee(self) -> ee.Geometry:
+        if self._aoi_ee is None:
+            self._aoi_ee = aoi2eegeo(self.aoi)
+        return self._aoi_ee
+
+    @property
+    def region_ee(self) -> dict:
+        """Geometries reduced for the timeseries, "" is the main aoi."""
+        if self._region_ee is None:
+            self._region_ee = {"": self.aoi_ee} if self.aoi is not None else {}
+            for name, manager in self.regions.items():
+                geotype = "Point" if np.ndim(manager.coords) == 1 else "Polygon"
+                self._region_ee[name] = aoi2eegeo(manager.coords, geotype)
+        return self._region_ee
+
+    @property
+    def reducer(self) -> ee.Reducer:
+        if self._reducer is None:
+            self._reducer = stats_reducer(self.ts_stats, self.ts_percentiles)
+        return self._reducer
+
+    def report(self) -> None:
+        super().report()
+        metrics = self.scheduler.metrics()
+        print(f"earth engine requests: {metrics}")
+        if self.ee_cache.mode != "off":
+            print(f"earth engine cache: {self.ee_cache.stats()}")
+
+    def search_key(self) -> list:
+        """Parameters of the collection search, part of the cache keys."""
+        return ["COPERNICUS/S1_GRD", str(self.sdt), str(self.edt), "IW", self.aoi]
+
+    def regions_key(self) -> list:
+        return [self.aoi, {name: m.coords for name, m in self.regions.items()}]
+
+    def s1_collection(self) -> ee.ImageCollection:
         # search dates
         sdt_ee = stringdt2eedt(self.sdt)
         edt_ee = stringdt2eedt(self.edt)
@@ -70,44 +219,133 @@ class GEEDMS1(Datamod):
         aoi_ee = self.aoi_ee
         # search collection
         S1 = ee.ImageCollection("COPERNICUS/S1_GRD")
-        col = (
+        return (
             S1.filter(date_filter)
             .filter(ee.Filter.eq("instrumentMode", "IW"))
             .filterBounds(aoi_ee)
         )
-        # now get image names
-        tinfo = col.getInfo()["features"]  # just the names hopefully?
-        ims = []
-        for ind in range(len(tinfo)):
-            ims = np.append(ims, tinfo[ind]["id"])
+
+    def search_s1(self):
+        # now get image names and metadata in one request, new images can be
+        # added to the collection so cached searches expire
+        self.info = self.ee_cache.fetch(
+            make_key("search", self.search_key()),
+            lambda: collection_info(self.s1_collection()),
+            ttl=self.search_ttl,
+        )
+        ims = list(self.info)
         print(f"found {str(len(ims))} images")
         return ims
 
     def read_file(self, file: str) -> GEEProdS1:
-        return GEEProdS1(file)
-
-    def subset(self, prod: GEEProdS1, do_avg: bool = False, **kwargs) -> GEEProdS1:
-        prod.feats = {}
-        for bname in prod.bands:
-            img = prod.img.select(bname)
-            proj = prod.get_proj(img)
-            imgll = img.addBands(ee.Image.pixelLonLat())
-            if do_avg:
-                prod.img = prod.img.reduceRegion(
-                    reducer=ee.Reducer.mean(), geometry=self.aoi_ee
+        return GEEProdS1(file, info=self.info.get(file), ee_cache=self.ee_cache)
+
+    def subset(self, prod: GEEProdS1, **kwargs) -> GEEProdS1:
+        # the rectangle is only sampled if the pixels are not cached
+        prod.sample_aoi = self.aoi
+        prod.pixel_key = make_key(
+            "pixels", prod.id, prod.bands, hash_aoi(self.aoi, self.aoi_crs)
+        )
+        prod.pixels = None
+        return prod
+
+    def region_stats(self, img: ee.Image, bands: list[str]) -> ee.FeatureCollection:
+        """Server side statistics of bands over the aoi and each region."""
+        feats = []
+        for name, geom in self.region_ee.items():
+            values = img.select(bands).reduceRegion(
+                reducer=self.reducer,
+                geometry=geom,
+                scale=self.ee_scale,
+                maxPixels=1e9,
+            )
+            feats.append(
+                ee.Feature(None, values).set(
+                    {
+                        "id": img.get("system:id"),
+                        "millis": img.date().millis(),
+                        "region": name,
+                    }
                 )
-            else:
-                num_pixels = imgll.reduceRegion(
-                    reducer=ee.Reducer.count(), geometry=self.aoi_ee
-                ).getInfo()
-                print(f"num pixels: {num_pixels}")
-                feat = (
-                    imgll.unmask(0)
-                    .setDefaultProjection(proj)
-                    .sampleRectangle(self.aoi_ee)
+            )
+        return ee.FeatureCollection(feats)
+
+    def feature_row(self, props: dict, bands: list[str]) -> dict:
+        """Timeseries row in the accumulator format from reduced properties."""
+        str_meta = Path(props["id"]).name.split("_")
+        row = {
+            "_metas": ["datetime", "sat", "mode"],
+            "_bands": bands,
+            "region": props["region"] or None,
+            "datetime": millis2pydt(props["millis"]),
+            "sat": str_meta[0],
+            "mode": str_meta[1],
+        }
+        for bname in bands:
+            for stat in self.stat_names:
+                # a single output is named after the band only
+                key = bname if len(self.stat_names) == 1 else f"{bname}_{stat}"
+                value = props.get(key)
+                row[stat_key(bname, stat)] = np.nan if value is None else value
+        return row
+
+    def summarise(self, prod: GEEProdS1) -> list[dict]:
+        """Timeseries rows of one image, in one request for all regions.
+
+        In collection mode the rows are fetched for the whole collection by
+        timeseries instead.
+        """
+        if self.ts_mode == "collection":
+            return []
+        bands = [bname for bname in self.ts_bands if bname in prod.bands]
+        key = make_key(
+            "stats", prod.id, bands, self.regions_key(), self.ee_scale, self.stat_names
+        )
+        feats = self.ee_cache.fetch(
+            key, lambda: getinfo(self.region_stats(prod.img, bands))["features"]
+        )
+        return [self.feature_row(feat["properties"], bands) for feat in feats]
+
+    def collection_stats(self, bands: list[str]) -> ee.FeatureCollection:
+        """region_stats of every image in the collection that has all bands."""
+        col = self.s1_collection()
+        for bname in bands:
+            if bname != "angle":
+                col = col.filter(
+                    ee.Filter.listContains("transmitterReceiverPolarisation", bname)
                 )
-                prod.feats[bname] = feat
-        return prod
+        return ee.FeatureCollection(
+            col.map(lambda img: self.region_stats(img, bands))
+        ).flatten()
+
+    def timeseries(self, **kwargs) -> None:
+        """Save the timeseries of the aoi and regions.
+
+        In collection mode the reducer is mapped over the whole filtered
+        collection on the server and the table is fetched in pages of
+        ee_page_size rows, so a season takes a few requests.
+        """
+        if self.ts_mode == "collection":
+            bands = self.ts_bands
+            key = make_key(
+                "collection_stats",
+                self.search_key(),
+                bands,
+                self.regions_key(),
+                self.ee_scale,
+                self.stat_names,
+            )
+            feats = self.ee_cache.fetch(
+                key,
+                lambda: fetch_features(self.collection_stats(bands), self.ee_page_size),
+                ttl=self.search_ttl,
+            )
+            for feat in feats:
+                self.accumulator.add(self.feature_row(feat["properties"], bands))
+        if len(self.accumulator.rows) == 0:
+            print("no scenes in time series")
+            return
+        self.write_timeseries()
 
     def plot(
         self,
@@ -118,26 +356,19 @@ class GEEDMS1(Datamod):
         **kwargs,
     ) -> None:
         if plot_type == "plt":
-            feat = prod.feats[plot_band]
-            tband = prod.get_band(feat, plot_band)
+            import matplotlib.pyplot as plt
+
+            tband = prod.get_band(plot_band)
+            print(f"num pixels: {tband.size}")
             plt.rcParams.update({"font.family": "Times New Roman", "font.size": 7})
             _, ax = plt.subplots(figsize=[2, 1.5])
             im = ax.imshow(tband, vmin=-30, vmax=-5, cmap="pink", origin="upper")
             if stn_coords[0] is not None:
-                tlon = prod.get_band(feat, "longitude")
-                tlat = prod.get_band(feat, "latitude")
+                tlon = prod.get_band("longitude")
+                tlat = prod.get_band("latitude")
                 # now find pixel for station
-                tlonfl = tlon.flatten()
-                tlatfl = tlat.flatten()
                 print("looking for pixel with min distance to stn_coords")
-                distfl = [
-                    dist_coords([lon, lat], stn_coords)
-                    for lon, lat in zip(tlonfl, tlatfl)
-                ]
-                distfl = np.array(distfl)
-                min_dist = np.min(distfl)
-                dist = np.reshape(distfl, tlon.shape)
-                stnp1, stnp2 = np.where(dist == min_dist)
+                stnp1, stnp2 = self.locator.locate(tlon, tlat, stn_coords)
                 ax.plot(stnp2, stnp1, "*", color="blue", markersize=5)
             plt.tick_params(
                 left=False,
@@ -153,10 +384,13 @@ class GEEDMS1(Datamod):
                 prod.metadict["sat"] + "_%Y%m%d_%H%M%S.png"
             )
             save_fig(figt)
+            prod.outputs.append(figt)
             print(f"saved image to: {figt}")
             plt.close()
 
         if plot_type == "folium":
+            import folium
+
             folium.Map.add_ee_layer = add_ee_layer
 
             if stn_coords[0] is None:
@@ -176,4 +410,5 @@ class GEEDMS1(Datamod):
                 prod.metadict["sat"] + "_%Y%m%d_%H%M%S.html"
             )
             Map.save(figt)
+            prod.outputs.append(figt)
             webbrowser.open(figt)
@@ -1,18 +1,19 @@
 import datetime
 
 import ee
-import folium
-from geopy.distance import distance
 
+from datamodules.ee_scheduler import get_scheduler
 
-def dist_coords(ll1: list[float], ll2: list[float]) -> float:
-    """Input [lon, lat] for each ll."""
-    d = distance((ll1[1], ll1[0]), (ll2[1], ll2[0])).m
-    return d
+
+def getinfo(obj):
+    """Call getInfo through the request scheduler."""
+    return get_scheduler().getinfo(obj)
 
 
 def basemaps(mapName):
     """Add custom base maps to folium."""
+    import folium
+
     basemaps = {
         "Google Maps": folium.TileLayer(
             tiles="https://mt1.google.com/vt/lyrs=m&x={x}&y={y}&z={z}",
@@ -61,7 +62,11 @@ def basemaps(mapName):
 
 def add_ee_layer(self, ee_image_object, vis_params, name):
     """Define a method for displaying Earth Engine image tiles to folium map."""
-    map_id_dict = ee.Image(ee_image_object).getMapId(vis_params)
+    import folium
+
+    map_id_dict = get_scheduler().call(
+        ee.Image(ee_image_object).getMapId, vis_params, name="getMapId"
+    )
     folium.raster_layers.TileLayer(
         tiles=map_id_dict["tile_fetcher"].url_format,
         attr='Map Data &copy; <a href="https://earthengine.google.com/">Google Earth Engine</a>',
@@ -77,8 +82,15 @@ def auth():
     ee.Authenticate()
 
 
+_initialised = False
+
+
 def init():
-    ee.Initialize()
+    # once per process, datamodules unpickled in worker processes call it too
+    global _initialised
+    if not _initialised:
+        ee.Initialize()
+        _initialised = True
 
 
 def stringdt2eedt(dt: str):
@@ -93,11 +105,88 @@ def aoi2eegeo(aoi: list[float], geotype: str = "Polygon", proj: str = None):
         return ee.Geometry.Point(aoi, proj=proj)
 
 
+def millis2pydt(millis: float):
+    return datetime.datetime.utcfromtimestamp(millis / 1000.0)
+
+
 def ee2pydt(eedt):
-    pydt = datetime.datetime.utcfromtimestamp(eedt.getInfo()["value"] / 1000.0)
+    pydt = millis2pydt(getinfo(eedt)["value"])
     return pydt
 
 
+def collection_info(col) -> dict:
+    """Dates, band names and properties of every image in a collection.
+
+    The metadata is gathered server side with ImageCollection.map so the whole
+    collection needs a single getInfo. Returns {image id: info}.
+    """
+
+    def img_info(img):
+        return ee.Feature(
+            None,
+            {
+                "id": img.get("system:id"),
+                "millis": img.date().millis(),
+                "bands": img.bandNames(),
+                "props": img.toDictionary(),
+            },
+        )
+
+    feats = getinfo(ee.FeatureCollection(col.map(img_info)))["features"]
+    return {feat["properties"]["id"]: feat["properties"] for feat in feats}
+
+
+def stat_names(stats: list[str] = [], percentiles: list[float] = []) -> list[str]:
+    """Names of the statistics reduced on the server, in output order.
+
+    Same statistics and names as the local timeseries (mean, std and count,
+    percentiles as p<q>), mad has no server side reducer and is left out.
+    """
+    names = ["median"] + [f"p{q:g}" for q in percentiles]
+    for stat in stats:
+        if stat not in ["mean", "std", "count"]:
+            print(f"{stat} is not available from earth engine, skipping")
+            continue
+        names.append(stat)
+    return names
+
+
+def stats_reducer(stats: list[str] = [], percentiles: list[float] = []):
+    """Reducer of the median, percentiles and stats, see stat_names."""
+    names = ["median"] + [f"p{q:g}" for q in percentiles]
+    reducer = ee.Reducer.percentile([50] + list(percentiles), names)
+    others = {
+        "mean": ee.Reducer.mean,
+        "std": ee.Reducer.stdDev,
+        "count": ee.Reducer.count,
+    }
+    for stat in stats:
+        if stat in others:
+            reducer = reducer.combine(
+                others[stat]().setOutputs([stat]), sharedInputs=True
+            )
+    return reducer
+
+
+def fetch_features(fc, page_size: int = 5000) -> list[dict]:
+    """Features of a collection, page_size features per getInfo.
+
+    If the first page is full the size of the collection is asked for and the
+    other pages are fetched concurrently through the request scheduler.
+    """
+    feats = getinfo(fc.toList(page_size, 0))
+    if len(feats) < page_size:
+        return feats
+    offsets = range(page_size, getinfo(fc.size()), page_size)
+
+    def get_page(offset: int) -> list[dict]:
+        return fc.toList(page_size, offset).getInfo()
+
+    for page in get_scheduler().map(get_page, offsets, name="getInfo"):
+        feats += page
+    return feats
+
+
 def py2eedt(pydt):
     eedt = ee.Date(pydt)
     return eedt
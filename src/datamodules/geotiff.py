@@ -1,24 +1,67 @@
 import os
-import pickle
-from datetime import datetime as dt
-from math import ceil
+from concurrent.futures import ThreadPoolExecutor
 
-import matplotlib.pyplot as plt
 import numpy as np
 import rioxarray as rx
-from matplotlib.dates import DateFormatter, date2num
-from rioxarray.exceptions import NoDataInBounds
+import xarray as xr
 
-from datamodules.base import Datamod, Product
+from datamodules.bandmath import BandExpr, compile_exprs
+from datamodules.base import Datamod, Product, to_container
+from datamodules.cache import DiskCache, make_key
+from datamodules.catalog import SceneCatalog
+from datamodules.cube import SceneStack, group_by_grid, write_temporal
+from datamodules.plotting import plot_bands
+from datamodules.store import (
+    STORE_EXT,
+    init_store,
+    load_product,
+    open_band,
+    save_band,
+    save_product,
+)
+from datamodules.timeseries import TimeseriesAccumulator
 from datamodules.utils import (
+    bounds_to_window,
     checkdir,
-    create_gdf_from_coords,
-    lin_to_db,
+    hash_aoi,
+    list_band_files,
+    parse_band_name,
+    parse_scene_meta,
     pload,
-    psave,
-    save_fig,
+    prep_array,
+    scene_mtime,
 )
 
+# bands converted to db
+DB_SET = [
+    "HH",
+    "HV",
+    "CH",
+    "CV",
+    "RLd",
+    "RRd",
+    "mchi_dbl",
+    "mchi_surf",
+    "mchi_vol",
+    "s0",
+    "s1",
+    "s2",
+    "s3",
+]
+
+
+class ProductCache(DiskCache):
+    """Cache of subset products in the zarr product store."""
+
+    ext = STORE_EXT
+
+    def dump(self, prod: Product, path: str) -> None:
+        save_product(prod, path)
+
+    def load(self, path: str) -> Product:
+        # subsets are small, load them so evicted entries can be deleted
+        return load_product(path, load=True)
+
 
 class RCMProd(Product):
     def __init__(
@@ -29,81 +72,95 @@ class RCMProd(Product):
         conv_to_db: bool = True,
         crs: str = "EPSG:4326",
         bands_use: list[str] = None,
+        lazy: bool = False,
+        chunks: dict = None,
+        bounds: list[float] = None,
+        band_dtype: str = "float32",
+        block_rows: int = 1024,
+        band_workers: int = 1,
         **kwargs,
     ) -> None:
         super().__init__(**kwargs)
+        self.conv_to_db = conv_to_db
+        self.band_dtype = np.dtype(band_dtype)
+        self.block_rows = block_rows
+        # bands that still need nodata filling and db conversion
+        self.pending = []
         if meta_map is None:
             raise Exception("need to provide meta_map")
         # get metadata
         self.file = os.path.basename(file)
-        metastr = os.path.split(file)[1].split("_")
-        try:
-            self.metadict["datetime"] = dt.strptime(
-                metastr[meta_map["date"]] + metastr[meta_map["time"]], "%Y%m%d%H%M%S"
-            )
-            self.metadict["sat"] = metastr[meta_map["sat"]]
-            self.metadict["mode"] = metastr[meta_map["mode"]]
-        except Exception as e:
-            print(e)
-            raise Exception("probably need to change indexes to metadata in filename")
+        self.metadict.update(parse_scene_meta(file, meta_map))
 
         # get bands
+        self.band_workers = band_workers
         dir = file + "/" + subdir
-        sublist = os.listdir(dir)
-        sublist = [file for file in sublist if file[-4:] == ".tif"]
-        for file in sublist:
-            full_file = dir + file
-            file = file.split(".")[0]  # remove ext
-            filemeta = file.split("_")
-            # bname = filemeta[meta_map["band"]]
-            bname = ""
-            for i in range(meta_map["band"], len(filemeta)):
-                if filemeta[i] in [
-                    "orf",
-                    "cs",
-                    "c2d",
-                    "fenhlee",
-                    "cp2rrrl",
-                    "poldiscr",
-                    "txC",
-                ]:
-                    continue
-                if len(bname) > 0:
-                    bname += "_"
-                bname += filemeta[i]
+        files = {}
+        for file in list_band_files(dir):
+            bname = parse_band_name(file, meta_map)
             if bands_use is not None and bname not in bands_use:
                 continue
-            rxt = rx.open_rasterio(full_file)
-            rxt.values[rxt.values == 0] = np.nan
-            rxt = rxt.squeeze(drop=True)
+            files[bname] = dir + file
+        # the default rasterio lock lets one thread read at a time, each band
+        # is its own file so parallel reads do not need it
+        lock = False if band_workers > 1 else None
 
-            # convert to db
-            db_set = [
-                "HH",
-                "HV",
-                "CH",
-                "CV",
-                "RLd",
-                "RRd",
-                "mchi_dbl",
-                "mchi_surf",
-                "mchi_vol",
-                "s0",
-                "s1",
-                "s2",
-                "s3",
-            ]
-            if bname in db_set and conv_to_db:
-                rxt.values = lin_to_db(rxt.values)
-            print(f"min / max / mean for band {bname}:")
-            print(
-                f"{np.nanmin(rxt.values):.1f}, {np.nanmax(rxt.values):.1f}, {np.nanmean(rxt.values):.1f}"
-            )
+        def open_band(bname: str) -> xr.DataArray:
+            # pixels are only read from disk when the values are first accessed
+            rxt = rx.open_rasterio(files[bname], chunks=chunks, lock=lock)
+            rxt = rxt.squeeze(drop=True)
 
             # check crs using: rxt.spatial_ref
             rxt = rxt.rio.write_crs(crs)
 
+            if bounds is not None:
+                rows, cols = bounds_to_window(
+                    bounds, rxt.rio.transform(), rxt.rio.shape
+                )
+                rxt = rxt.isel(y=rows, x=cols)
+            return rxt
+
+        for bname, rxt in zip(files, self.map_bands(open_band, list(files))):
+            self.bands[bname] = rxt
+        self.pending = list(files)
+        if not lazy:
+            self.prep_bands(self.pending)
+
+    def map_bands(self, fn, bnames: list[str]) -> list:
+        """fn applied to each band name, on band_workers threads."""
+        workers = min(getattr(self, "band_workers", 1), len(bnames))
+        if workers <= 1:
+            return [fn(bname) for bname in bnames]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(fn, bnames))
+
+    def prep_values(self, bname: str, arr: np.ndarray) -> tuple:
+        """Set nodata to nan and convert to db in place, returns (arr, stats)."""
+        if arr.dtype != self.band_dtype:
+            arr = arr.astype(self.band_dtype)
+        to_db = bname in DB_SET and self.conv_to_db
+        stats = prep_array(arr, nodata=0, to_db=to_db, block_rows=self.block_rows)
+        return arr, stats
+
+    def prep_bands(self, bnames: list[str]) -> None:
+        """Set nodata to nan, convert to db and print stats for each band.
+
+        Done in place on the band_dtype arrays, nodata is recorded in
+        _FillValue. The bands are read and converted in parallel.
+        """
+        bnames = list(bnames)
+        for bname, rxt in zip(bnames, self.map_bands(self.prepped_band, bnames)):
             self.bands[bname] = rxt
+            if bname in self.pending:
+                self.pending.remove(bname)
+
+    def prepped_band(self, bname: str) -> xr.DataArray:
+        rxt = self.bands[bname].load()
+        arr, (vmin, vmax, vmean) = self.prep_values(bname, rxt.values)
+        print(
+            f"min / max / mean for band {bname}:\n{vmin:.1f}, {vmax:.1f}, {vmean:.1f}"
+        )
+        return rxt.copy(data=arr).rio.write_nodata(np.nan)
 
     def get_band(self, bname: str) -> np.array:
         return self.bands[bname]
@@ -112,126 +169,382 @@ class RCMProd(Product):
         pass
 
 
+def add_band(prod: Product, bexpr: BandExpr, rows: int = 1024) -> None:
+    """Evaluate bexpr on the bands of prod and add the result to prod.bands."""
+    bands = {bname: np.asarray(prod.bands[bname].values) for bname in bexpr.inputs}
+    ref = prod.bands[bexpr.inputs[0]]
+    out = bexpr.evaluate(bands, rows)
+    band = xr.DataArray(out, coords=ref.coords, dims=ref.dims)
+    prod.bands[bexpr.name] = band.rio.write_nodata(np.nan)
+
+
 class RCMDM(Datamod):
-    def __init__(self, **kwargs) -> None:
+    def __init__(
+        self,
+        lazy: bool = False,
+        cache: str = "off",
+        cache_size_mb: float = 2048,
+        avg_values: bool = True,
+        ts_stats: list[str] = ["mean", "count"],
+        ts_percentiles: list[float] = [],
+        cube_block: int = 16,
+        temporal_rows: int = 256,
+        prefetch: bool = False,
+        band_exprs: dict = None,
+        catalog: bool = False,
+        sats: list[str] = None,
+        modes: list[str] = None,
+        bands_required: list[str] = None,
+        **kwargs,
+    ) -> None:
         super().__init__(**kwargs)
         self.prod_kwargs = kwargs
+        if catalog and kwargs.get("dir") is not None:
+            self.filelist = self.select_scenes(
+                kwargs["dir"], sats, modes, bands_required
+            )
+        if kwargs.get("subset_mode") == "tiled" and not lazy:
+            # streaming strips only saves memory if the scene is not read first
+            print("subset_mode tiled reads the bands lazily, setting lazy: True")
+            lazy = True
+        self.lazy = lazy
+        self.cube_block = cube_block
+        self.temporal_rows = temporal_rows
+        self.read_ahead = prefetch
+        # checked here so a bad expression fails before any scene is read
+        self.band_exprs = compile_exprs(to_container(band_exprs))
+        self.next_file = {}
+        self.prefetched = {}
+        self.prefetch_pool = None
+        # per-pixel temporal stats need the rasters of every scene
+        if "temporal" in kwargs.get("pipeline", []):
+            avg_values = False
+        self.accumulator = TimeseriesAccumulator(
+            avg_values=avg_values,
+            stats=ts_stats,
+            percentiles=ts_percentiles,
+            cubedir=self.outdir + "cube/",
+        )
+        # cached entries are subsets so only use them when subsetting, they
+        # only hold the main aoi so named regions need each scene to be read
+        if "subset" not in kwargs.get("pipeline", []) or self.regions:
+            cache = "off"
+        self.cache = ProductCache(
+            self.outdir + "cache/", mode=cache, max_size_mb=cache_size_mb
+        )
         # self.meta_map = meta_map
         # self.subdir = subdir
 
+    def select_scenes(
+        self,
+        dir: str,
+        sats: list[str] = None,
+        modes: list[str] = None,
+        bands: list[str] = None,
+    ) -> list[str]:
+        """Scenes in dir matching the dates, satellites, modes and bands.
+
+        Uses the scene catalog in outdir, which is brought up to date first, so
+        no raster is opened to choose the scenes.
+        """
+        catalog = SceneCatalog(
+            self.outdir + "catalog.sqlite",
+            self.prod_kwargs.get("meta_map"),
+            subdir=self.prod_kwargs.get("subdir", ""),
+            ext=self.prod_kwargs.get("ext", ""),
+        )
+        counts = catalog.update(dir)
+        print(f"scene catalog: {counts}")
+        filelist = catalog.select(self.sdt, self.edt, sats, modes, bands)
+        catalog.close()
+        print(f"number of files selected from catalog: {len(filelist)}")
+        return filelist
+
+    def aoi_bounds(self, crs: str) -> list[float]:
+        """Bounds [minx, miny, maxx, maxy] of the aoi and regions in the raster crs.
+
+        With named regions this is the union of their bounds, so a scene is read
+        once for all of them.
+        """
+        managers = list(self.regions.values())
+        if self.aoi is not None:
+            managers.append(self.aoi_manager)
+        bounds = np.array([manager.bounds(crs) for manager in managers])
+        return list(bounds[:, :2].min(axis=0)) + list(bounds[:, 2:].max(axis=0))
+
+    def cache_key(self, file: str) -> str:
+        """Key for the subset of a scene given the aoi, the band files read and
+        the band options."""
+        return make_key(
+            os.path.abspath(file),
+            scene_mtime(file),
+            hash_aoi(self.aoi, self.aoi_crs),
+            self.prod_kwargs.get("crs", "EPSG:4326"),
+            self.prod_kwargs.get("subdir", ""),
+            to_container(self.prod_kwargs.get("meta_map")),
+            self.prod_kwargs.get("bands_use"),
+            self.prod_kwargs.get("conv_to_db", True),
+            self.prod_kwargs.get("band_dtype", "float32"),
+        )
+
+    def prefetch(self, files: list[str]) -> None:
+        if not self.read_ahead:
+            return
+        self.next_file = dict(zip(files[:-1], files[1:]))
+        if self.prefetch_pool is None:
+            self.prefetch_pool = ThreadPoolExecutor(max_workers=1)
+
     def read_file(self, file: str, to_latlon: bool = True) -> RCMProd:
-        if file[-4:] != ".pkl":
-            return RCMProd(file, **self.prod_kwargs)
+        future = self.prefetched.pop(file, None)
+        prod = future.result() if future is not None else self.read_scene(file)
+        # the next scene is read in the background while this one is processed
+        nxt = self.next_file.get(file)
+        if nxt is not None:
+            self.prefetched[nxt] = self.prefetch_pool.submit(self.read_scene, nxt)
+        return prod
+
+    def read_scene(self, file: str) -> RCMProd:
+        if file.rstrip("/").endswith(STORE_EXT):
+            return load_product(file.rstrip("/"), self.prod_kwargs.get("bands_use"))
+        if file[-4:] == ".pkl":
+            # products saved before the zarr store
+            prod = pload(file)
+            prod.outputs = getattr(prod, "outputs", [])
+            return prod
+        key = None
+        if self.cache.mode != "off":
+            key = self.cache_key(file)
+            prod = self.cache.get(key)
+            if prod is not None:
+                print("loaded subset from cache")
+                prod.cached = True
+                return prod
+        if not self.lazy:
+            prod = RCMProd(file, **self.prod_kwargs)
         else:
-            return pload(file)
-
-    def plot(self, prod: RCMProd, **kwargs) -> None:
-        blen = len(prod.bands)
-        if "XC" in prod.bands:
-            blen -= 1
-        bname = [bn for bn in prod.bands]
-        plt.rcParams.update({"font.family": "Times New Roman", "font.size": 7})
-        cols = 4
-        rows = ceil(blen / cols)
-        plt.figure(figsize=[cols * 3, rows * 2.3])
-        # _, ax = plt.subplots(rows, cols, figsize=[cols * 4.5, rows * 3])
-        rowt = 0
-        colt = -1
-        ax = {}
-        for i in range(blen):
-            colt += 1
-            if colt > cols - 1:
-                colt = 0
-                rowt += 1
-            ax[i] = plt.subplot(rows, cols, i + 1)
-            band = prod.bands[bname[i]]
-            if bname[i] == "XC":
-                continue
-            if bname[i] not in self.lims_for_plotting:
-                # print(f"need to provide plot limits for var: {bname[i]}")
-                # continue
-                tscale = [None, None]
-            else:
-                tscale = self.lims_for_plotting[bname[i]]
-            cbkw = {}
-            cbkw["label"] = None
-            band.plot.imshow(
-                ax=ax[i],
-                vmin=tscale[0],
-                vmax=tscale[1],
-                cmap="pink",
-                cbar_kwargs=cbkw,
-                origin="upper",
-            )
-            ax[i].set_xlabel(None)
-            ax[i].set_ylabel(None)
-            ax[i].set_title(bname[i])
-        plt.subplots_adjust(
-            left=0.07, bottom=0.07, right=0.93, top=0.93, wspace=0.2, hspace=0.25
-        )
+            # only read the pixel window around the aoi
+            bounds = self.aoi_bounds(self.prod_kwargs.get("crs", "EPSG:4326"))
+            prod = RCMProd(file, lazy=True, bounds=bounds, **self.prod_kwargs)
+        prod.cache_key = key
+        return prod
+
+    def plot(
+        self, prod: RCMProd, plot_dpi: float = 300, plot_format: str = "png", **kwargs
+    ) -> None:
+        bands = {bname: band for bname, band in prod.bands.items() if bname != "XC"}
         figt = self.outdir + prod.metadict["datetime"].strftime(
-            prod.metadict["sat"] + "_%Y%m%d_%H%M%S.png"
+            prod.metadict["sat"] + "_%Y%m%d_%H%M%S." + plot_format
         )
-        save_fig(figt)
-        plt.close()
+        plot_bands(
+            bands, figt, self.lims_for_plotting, dpi=plot_dpi, format=plot_format
+        )
+        prod.outputs.append(figt)
         print(f"saved plot to: {figt} \n \n")
 
-    def subset(self, prod: RCMProd, **kwargs) -> RCMProd:
-        geodf = create_gdf_from_coords(self.aoi, crs=self.aoi_crs)
-        blen = len(prod.bands)
-        bname = [bn for bn in prod.bands]
-        for i in range(blen):
-            band = prod.bands[bname[i]]
-            try:
-                band = band.rio.clip(geodf.geometry.values, geodf.crs)
-            except NoDataInBounds:
+    def subset(
+        self,
+        prod: RCMProd,
+        subset_mode: str = "clip",
+        tile_size: int = 1024,
+        **kwargs,
+    ) -> RCMProd:
+        if getattr(prod, "cached", False):
+            return prod
+        if any(0 in band.shape for band in prod.bands.values()):
+            print("No data in bounds")
+            return None
+        if self.regions:
+            prod.regions = self.subset_regions(prod)
+            if self.aoi is None:
+                # only the named regions were asked for
+                if len(prod.regions) == 0:
+                    print("No data in bounds")
+                    return None
+                if getattr(prod, "pending", []):
+                    prod.prep_bands(prod.pending)
+                return prod
+        if subset_mode == "tiled":
+            prod = self.subset_tiled(prod, tile_size)
+            if prod is not None and getattr(prod, "cache_key", None) is not None:
+                self.cache.put(prod.cache_key, prod)
+            return prod
+        masks = {}
+        for bname, band in prod.bands.items():
+            band, mask = self.aoi_manager.clip(band)
+            if band is None:
                 print("No data in bounds")
                 return None
-            prod.bands[bname[i]] = band
+            prod.bands[bname] = band
+            masks[bname] = mask
+        # lazily read bands are only loaded and converted once clipped
+        if getattr(prod, "pending", []):
+            prod.prep_bands(prod.pending)
+        for bname, mask in masks.items():
+            band = prod.bands[bname]
+            prod.bands[bname] = band.where(xr.DataArray(mask, dims=band.dims))
+        if getattr(prod, "cache_key", None) is not None:
+            self.cache.put(prod.cache_key, prod)
         return prod
 
-    def save(self, prod: RCMProd, **kwargs) -> None:
+    def subset_regions(self, prod: RCMProd) -> dict[str, Product]:
+        """Clip the bands of prod to each named region.
+
+        Returns a product per region, regions that miss the scene are left out.
+        """
+        regions = {}
+        for name, manager in self.regions.items():
+            bands = {}
+            for bname, band in prod.bands.items():
+                band, mask = manager.clip(band)
+                if band is None:
+                    break
+                if bname in getattr(prod, "pending", []):
+                    arr = np.array(band.values, dtype=prod.band_dtype)
+                    arr, _ = prod.prep_values(bname, arr)
+                    band = band.copy(data=arr).rio.write_nodata(np.nan)
+                bands[bname] = band.where(xr.DataArray(mask, dims=band.dims))
+            else:
+                region = Product()
+                region.file = f"{prod.file}_{name}"
+                region.metadict = dict(prod.metadict)
+                region.bands = bands
+                regions[name] = region
+        print(f"regions in scene: {list(regions)}")
+        return regions
+
+    def subset_tiled(self, prod: RCMProd, tile_size: int = 1024) -> RCMProd:
+        """Clip each band to the aoi in strips of tile_size rows.
+
+        The aoi mask comes from the aoi manager, so it is rasterised once per
+        grid and shared by all bands and scenes on that grid. Each strip of
+        every band is read, converted, masked with the rows of the mask for that
+        strip and appended to a store in outdir/subsets/, so memory depends on
+        the tile size and not on the scene size. The clipped bands are then
+        opened lazily from the store.
+        """
+        path = self.outdir + "subsets/" + prod.file + STORE_EXT
+        checkdir(self.outdir + "subsets/")
+        init_store(prod, path)
+        clipped = {}
+        for bname, band in prod.bands.items():
+            clipped[bname] = self.aoi_manager.clip(band)
+            if clipped[bname][0] is None:
+                print("No data in bounds")
+                return None
+        pending = [bname for bname in clipped if bname in getattr(prod, "pending", [])]
+        nrows = max(band.shape[0] for band, _ in clipped.values())
+        for row in range(0, nrows, tile_size):
+            for bname, (band, mask) in clipped.items():
+                if row >= band.shape[0]:
+                    continue
+                strip = band.isel(y=slice(row, row + tile_size)).load()
+                arr = strip.values
+                if bname in pending:
+                    arr, _ = prod.prep_values(bname, arr)
+                arr[~mask[row : row + tile_size]] = np.nan
+                strip = strip.copy(data=arr).rio.write_nodata(np.nan)
+                save_band(strip, path, bname, chunks=tile_size, append=row > 0)
+        for bname in clipped:
+            if bname in pending:
+                prod.pending.remove(bname)
+            prod.bands[bname] = open_band(path, bname)
+        prod.store = path
+        prod.outputs.append(path)
+        print(f"saved subset to: {path}")
+        return prod
+
+    def bandmath(self, prod: RCMProd, **kwargs) -> None:
+        """Add the bands of band_exprs to the product and to each region.
+
+        Bands of a tiled subset are evaluated strip by strip from its store and
+        the results are appended to the same store.
+        """
+        rows = self.prod_kwargs.get("block_rows", 1024)
+        needed = [bname for bexpr in self.band_exprs for bname in bexpr.inputs]
+        pending = [bname for bname in getattr(prod, "pending", []) if bname in needed]
+        if pending:
+            prod.prep_bands(pending)
+        for bexpr in self.band_exprs:
+            if getattr(prod, "store", None) is not None:
+                self.stream_band(prod, bexpr, rows)
+            else:
+                add_band(prod, bexpr, rows)
+            for region in getattr(prod, "regions", {}).values():
+                add_band(region, bexpr, rows)
+            print(f"computed band {bexpr.name} = {bexpr.expr}")
+
+    def stream_band(self, prod: RCMProd, bexpr: BandExpr, rows: int) -> None:
+        ref = prod.bands[bexpr.inputs[0]]
+        for row in range(0, ref.shape[0], rows):
+            strips = {
+                bname: prod.bands[bname].isel(y=slice(row, row + rows)).values
+                for bname in bexpr.inputs
+            }
+            out = bexpr.evaluate(strips, rows)
+            strip = xr.DataArray(
+                out, coords=ref.isel(y=slice(row, row + rows)).coords, dims=ref.dims
+            ).rio.write_nodata(np.nan)
+            save_band(strip, prod.store, bexpr.name, chunks=rows, append=row > 0)
+        prod.bands[bexpr.name] = open_band(prod.store, bexpr.name)
+
+    def save(self, prod: RCMProd, store_chunks: int = 512, **kwargs) -> None:
         checkdir(self.savedir)
-        full_path = self.savedir + prod.file + ".pkl"
-        psave(prod, full_path)
-        exit()
+        full_path = self.savedir + prod.file + STORE_EXT
+        save_product(prod, full_path, chunks=store_chunks)
+        prod.outputs.append(full_path)
 
-    def timeseries(
-        self, prods: list[Product], avg_values: bool = True, **kwargs
-    ) -> None:
-        timeseriesdict = {}
-        metas = prods[0].metalist
-        bands = [band for band in prods[0].bands]
-        for meta in metas:
-            timeseriesdict[meta] = []
-        for band in bands:
-            timeseriesdict[band] = []
-        for prod in prods:
-            for meta in metas:
-                timeseriesdict[meta].append(prod.metadict[meta])
-            for band in bands:
-                bdata = prod.bands[band].values
-                if avg_values:
-                    bdata = np.nanmedian(bdata)
-                timeseriesdict[band].append(bdata)
-
-        dn = date2num(timeseriesdict["datetime"])
-        plt.rcParams.update({"font.family": "Times New Roman", "font.size": 7})
-        _, ax = plt.subplots(len(bands), 1, figsize=(4, 2.5 * len(bands)))
-        plt.subplots_adjust(
-            left=0.07, bottom=0.07, right=0.93, top=0.93, wspace=0.01, hspace=0.3
-        )
-        dformat = DateFormatter("%y-%m-%d")
-        for i, band in enumerate(bands):
-            ax[i].plot_date(dn, timeseriesdict[band])
-            ax[i].set_title(band)
-            ax[i].xaxis.set_major_formatter(dformat)
-        figt = self.outdir + "timeseries.png"
-        save_fig(figt)
-        plt.close()
-        print(f"saved plot to: {figt} \n \n")
+    def summarise(self, prod: RCMProd) -> list[dict]:
+        """Timeseries rows of the aoi and of each region found in the scene."""
+        rows = []
+        if self.aoi is not None:
+            rows.append(self.accumulator.summarise(prod))
+        for name, region in getattr(prod, "regions", {}).items():
+            rows.append(self.accumulator.summarise(region, region=name))
+        return rows
 
-        savepkl = self.outdir + "timeseries.pkl"
-        with open(savepkl, "wb") as f:
-            pickle.dump(timeseriesdict, f)
-        print(f"saved time series data to: {savepkl}")
+    def timeseries(self, prods: list[Product] = None, **kwargs) -> None:
+        """Save the timeseries collected in the accumulator.
+
+        Products passed in are added to the accumulator first. Each named region
+        gets its own timeseries_<region> plot and store.
+        """
+        for prod in prods or []:
+            for row in self.summarise(prod):
+                self.accumulator.add(row)
+        if len(self.accumulator.rows) == 0:
+            print("no scenes in time series")
+            return
+        self.accumulator.reduce_stores(block=self.cube_block)
+        self.write_timeseries()
+
+    def temporal(self) -> None:
+        """Write per-pixel temporal statistics and change maps of the stacked
+        subsets to outdir/temporal/<region>/ (aoi for the main aoi)."""
+        bands = self.accumulator.bands
+        db_bands = []
+        if self.prod_kwargs.get("conv_to_db", True):
+            db_bands = [bname for bname in bands if bname in DB_SET]
+        for region in [None] + self.accumulator.regions:
+            tsdict = self.accumulator.to_dict(region)
+            if "store" not in tsdict:
+                continue
+            # scenes have to be on the same grid, keep the most common one
+            groups = group_by_grid(tsdict["store"], bands[0])
+            inds = max(groups.values(), key=len)
+            if len(inds) < len(tsdict["store"]):
+                print(
+                    f"skipping {len(tsdict['store']) - len(inds)} scenes on other grids"
+                )
+            stack = SceneStack([tsdict["store"][i] for i in inds], bands)
+            times = [tsdict["datetime"][i] for i in inds]
+            outdir = self.outdir + "temporal/" + (region or "aoi") + "/"
+            files = write_temporal(
+                stack,
+                outdir,
+                times,
+                percentiles=self.accumulator.percentiles,
+                rows=self.temporal_rows,
+                db_bands=db_bands,
+            )
+            print(f"saved temporal statistics of {len(stack)} scenes to: {outdir}")
+            print(f"files: {[os.path.basename(file) for file in files]}")
@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+from math import ceil
+
+import numpy as np
+
+RC_PARAMS = {"font.family": "Times New Roman", "font.size": 7}
+
+# figure templates of each thread (or worker process), keyed by band layout,
+# the least recently used ones are closed past MAX_TEMPLATES
+_local = threading.local()
+MAX_TEMPLATES = 8
+
+
+def band_extent(band) -> list[float]:
+    """Image extent [left, right, bottom, top] from the pixel centre coords."""
+    x = band["x"].values
+    y = band["y"].values
+    dx = (x[-1] - x[0]) / (len(x) - 1) if len(x) > 1 else 1
+    dy = (y[-1] - y[0]) / (len(y) - 1) if len(y) > 1 else -1
+    return [x[0] - dx / 2, x[-1] + dx / 2, y[-1] + dy / 2, y[0] - dy / 2]
+
+
+def data_lims(arr: np.ndarray, lims: list[float] = None) -> tuple[float]:
+    """Colour limits, missing ones are taken from the data."""
+    vmin, vmax = lims if lims is not None else [None, None]
+    if vmin is None or vmax is None:
+        valid = arr[np.isfinite(arr)]
+        if valid.size == 0:
+            return 0, 1
+        vmin = valid.min() if vmin is None else vmin
+        vmax = valid.max() if vmax is None else vmax
+    return vmin, vmax
+
+
+class BandFigure:
+    """Grid of band images drawn on an Agg canvas, without pyplot.
+
+    The figure, axes, images and colorbars are built once for a band layout and
+    each scene only replaces the image data, extent and colour limits, so a
+    template can be reused for every scene with the same bands and shapes.
+    """
+
+    def __init__(self, bnames: list[str], shapes: list[tuple], cols: int = 4) -> None:
+        from matplotlib import rc_context
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        rows = ceil(len(bnames) / cols)
+        with rc_context(RC_PARAMS):
+            self.fig = Figure(figsize=[cols * 3, rows * 2.3])
+            FigureCanvasAgg(self.fig)
+            self.fig.subplots_adjust(
+                left=0.07, bottom=0.07, right=0.93, top=0.93, wspace=0.2, hspace=0.25
+            )
+            self.images = {}
+            for i, (bname, shape) in enumerate(zip(bnames, shapes)):
+                ax = self.fig.add_subplot(rows, cols, i + 1)
+                im = ax.imshow(np.zeros(shape, dtype=np.float32), cmap="pink")
+                self.fig.colorbar(im, ax=ax)
+                ax.set_title(bname)
+                self.images[bname] = im
+
+    def set_data(self, bands: dict, lims: dict) -> None:
+        for bname, im in self.images.items():
+            arr = np.asarray(bands[bname].values)
+            im.set_data(arr)
+            im.set_extent(band_extent(bands[bname]))
+            im.set_clim(*data_lims(arr, lims.get(bname)))
+
+    def save(self, path: str, dpi: float = 300, format: str = "png") -> None:
+        from matplotlib import rc_context
+
+        # tick labels are made when drawing so they need the rc params too
+        with rc_context(RC_PARAMS):
+            self.fig.savefig(path, dpi=dpi, format=format)
+
+    def close(self) -> None:
+        # drop the artists and the scene arrays they hold
+        self.fig.clear()
+        self.images = {}
+
+
+def band_figure(bnames: list[str], shapes: list[tuple]) -> BandFigure:
+    """Figure template for a band layout, built once per thread and kept for
+    the MAX_TEMPLATES most recently used layouts."""
+    templates = getattr(_local, "templates", None)
+    if templates is None:
+        templates = _local.templates = OrderedDict()
+    key = (tuple(bnames), tuple(shapes))
+    if key in templates:
+        templates.move_to_end(key)
+        return templates[key]
+    templates[key] = BandFigure(bnames, shapes)
+    while len(templates) > MAX_TEMPLATES:
+        templates.popitem(last=False)[1].close()
+    return templates[key]
+
+
+def plot_bands(
+    bands: dict, path: str, lims: dict = None, dpi: float = 300, format: str = "png"
+) -> None:
+    """Plot each band in its own panel and save the figure to path."""
+    bnames = list(bands)
+    shapes = [bands[bname].shape for bname in bnames]
+    fig = band_figure(bnames, shapes)
+    fig.set_data(bands, lims or {})
+    fig.save(path, dpi=dpi, format=format)
@@ -0,0 +1,124 @@
+import os
+from datetime import datetime as dt
+
+import numpy as np
+import rioxarray  # noqa: F401
+import xarray as xr
+
+from datamodules.base import Product
+
+STORE_EXT = ".zarr"
+ENCODING_ATTRS = ["scale_factor", "add_offset", "_FillValue"]
+
+
+def init_store(prod: Product, path: str) -> None:
+    """Create a store with the product metadata as attributes of the root group."""
+    attrs = {"file": getattr(prod, "file", ""), "bands": list(prod.bands)}
+    for meta, value in prod.metadict.items():
+        if isinstance(value, dt):
+            value = value.isoformat()
+        attrs[meta] = value
+    xr.Dataset(attrs=attrs).to_zarr(path, mode="w")
+
+
+def band_dataset(band: xr.DataArray, bname: str) -> xr.Dataset:
+    band = band.copy(deep=False)
+    # drop encodings inherited from the source geotiff (dtype, scaling...)
+    encoding = {k: v for k, v in band.encoding.items() if k == "grid_mapping"}
+    attrs = {}
+    for k, v in band.attrs.items():
+        if k in ENCODING_ATTRS:
+            if k == "_FillValue":
+                encoding[k] = v
+            continue
+        attrs[k] = v
+    band.attrs, band.encoding = attrs, encoding
+    return band.to_dataset(name=bname)
+
+
+def save_band(
+    band: xr.DataArray, path: str, bname: str, chunks: int = 512, append: bool = False
+) -> None:
+    """Write a band to its group, or append it along y to the rows already there."""
+    ds = band_dataset(band, bname)
+    if append:
+        ds.to_zarr(path, group=bname, append_dim="y")
+        return
+    encoding = {}
+    if band.chunks is None:
+        encoding[bname] = {"chunks": tuple(min(chunks, n) for n in band.shape)}
+    ds.to_zarr(path, group=bname, mode="a", encoding=encoding)
+
+
+def save_product(prod: Product, path: str, chunks: int = 512) -> None:
+    """Write each band as a chunked, compressed array in its own zarr group.
+
+    The product metadata is stored as attributes of the root group.
+    """
+    init_store(prod, path)
+    for bname, band in prod.bands.items():
+        save_band(band, path, bname, chunks=chunks)
+    print(f"saved product to: {path}")
+
+
+def open_band(path: str, bname: str) -> xr.DataArray:
+    """Open a band lazily, pixels are only read when indexed or loaded."""
+    ds = xr.open_dataset(
+        path, engine="zarr", group=bname, chunks=None, decode_coords="all"
+    )
+    band = ds[bname]
+    if "spatial_ref" in ds.data_vars:
+        # keep the crs as a coordinate so rioxarray can find it
+        band = band.assign_coords(spatial_ref=ds["spatial_ref"])
+    return band
+
+
+def load_product(path: str, bands: list[str] = None, load: bool = False) -> Product:
+    """Open a stored product, optionally only some of the bands."""
+    attrs = xr.open_dataset(path, engine="zarr", chunks=None).attrs
+    prod = Product()
+    prod.file = attrs.get("file", os.path.basename(path))
+    for meta in prod.metalist:
+        prod.metadict[meta] = attrs.get(meta)
+    if prod.metadict["datetime"] is not None:
+        prod.metadict["datetime"] = dt.fromisoformat(prod.metadict["datetime"])
+    for bname in attrs["bands"]:
+        if bands is not None and bname not in bands:
+            continue
+        band = open_band(path, bname)
+        prod.bands[bname] = band.load() if load else band
+    print(f"opened product: {path}")
+    return prod
+
+
+def save_timeseries(timeseriesdict: dict, metas: list[str], path: str) -> bool:
+    """Write a timeseries dict to zarr with a time dimension.
+
+    Returns False if the band arrays have different shapes and cannot be stacked.
+    """
+    times = np.array(timeseriesdict["datetime"], dtype="datetime64[ns]")
+    ds = xr.Dataset(coords={"time": times})
+    for key, values in timeseriesdict.items():
+        if key == "datetime":
+            continue
+        if key in metas or isinstance(values[0], str):
+            ds[key] = ("time", np.array(values, dtype=object))
+            continue
+        shapes = {np.shape(value) for value in values}
+        if len(shapes) > 1:
+            return False
+        arr = np.stack([np.asarray(value) for value in values])
+        dims = ["time"] + [f"dim_{i}" for i in range(arr.ndim - 1)]
+        ds[key] = (dims, arr)
+    ds.to_zarr(path, mode="w")
+    return True
+
+
+def save_table(table, path: str) -> str:
+    """Write a table to path.parquet, or to path.csv if pyarrow is missing."""
+    try:
+        table.to_parquet(path + ".parquet", index=False)
+        return path + ".parquet"
+    except ImportError:
+        table.to_csv(path + ".csv", index=False)
+        return path + ".csv"
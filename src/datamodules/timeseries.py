@@ -0,0 +1,134 @@
+import numpy as np
+
+from datamodules.base import Product
+from datamodules.cube import SceneStack, group_by_grid, reduce_pixels
+from datamodules.store import STORE_EXT, save_product
+from datamodules.utils import checkdir
+
+
+def stat_key(bname: str, stat: str) -> str:
+    """Timeseries key of a band statistic, the median is stored as the band."""
+    return bname if stat == "median" else f"{bname}_{stat}"
+
+
+class TimeseriesAccumulator:
+    """Collect a timeseries one scene at a time without keeping the products.
+
+    Each finished scene is reduced to a row of metadata and per-band statistics
+    (the band median is stored under the band name). If avg_values is False the
+    rasters are written to a per-scene store in cubedir instead and the row
+    keeps the path, the statistics are then computed from the stacked stores by
+    reduce_stores. Rows of named regions
+    carry the region name and are kept apart from the main aoi rows.
+    """
+
+    def __init__(
+        self,
+        avg_values: bool = True,
+        stats: list[str] = ["mean", "count"],
+        percentiles: list[float] = [],
+        cubedir: str = None,
+    ) -> None:
+        self.avg_values = avg_values
+        self.stats = list(stats)
+        self.percentiles = list(percentiles)
+        self.cubedir = cubedir
+        self.rows = []
+        self.metas = []
+        self.bands = []
+        self.regions = []
+
+    def summarise(self, prod: Product, region: str = None) -> dict:
+        """Reduce a product to a timeseries row (can run in a worker)."""
+        row = {"_metas": prod.metalist, "_bands": list(prod.bands), "region": region}
+        for meta in prod.metalist:
+            row[meta] = prod.metadict[meta]
+        if not self.avg_values:
+            # statistics come later from the stacked stores, see reduce_stores
+            checkdir(self.cubedir)
+            row["store"] = self.cubedir + prod.file + STORE_EXT
+            save_product(prod, row["store"])
+            return row
+        for bname, band in prod.bands.items():
+            bstats = reduce_pixels(
+                np.asarray(band.values).ravel(), self.stats, self.percentiles
+            )
+            for stat, value in bstats.items():
+                row[stat_key(bname, stat)] = value.item()
+        return row
+
+    def reduce_stores(self, block: int = 16) -> None:
+        """Fill in the statistics of rows whose rasters were only stored.
+
+        The stores of each region that share a grid are stacked as a (time,
+        band, y, x) cube and reduced over y, x one block of scenes at a time.
+        """
+        todo = stat_key(self.bands[0], "median") if self.bands else None
+        rows = [row for row in self.rows if "store" in row and todo not in row]
+        for region in set(row.get("region") for row in rows):
+            rrows = [row for row in rows if row.get("region") == region]
+            stores = [row["store"] for row in rrows]
+            for inds in group_by_grid(stores, self.bands[0]).values():
+                stack = SceneStack([stores[i] for i in inds], self.bands)
+                bstats = stack.reduce(self.stats, self.percentiles, block=block)
+                for t, i in enumerate(inds):
+                    for stat, values in bstats.items():
+                        for b, bname in enumerate(self.bands):
+                            rrows[i][stat_key(bname, stat)] = values[t, b].item()
+
+    def add(self, row: dict) -> None:
+        if row is None:
+            return
+        self.metas = row.pop("_metas", self.metas)
+        for bname in row.pop("_bands", []):
+            if bname not in self.bands:
+                self.bands.append(bname)
+        region = row.get("region")
+        if region is not None and region not in self.regions:
+            self.regions.append(region)
+        self.rows.append(row)
+
+    def to_dict(self, region: str = None) -> dict:
+        """Timeseries of the main aoi or of a region as a dict of lists.
+
+        Rows are sorted by datetime.
+        """
+        rows = [row for row in self.rows if row.get("region") == region]
+        rows = sorted(rows, key=lambda row: row["datetime"])
+        keys = []
+        for row in rows:
+            keys += [key for key in row if key not in keys and key != "region"]
+        # bands missing from a scene are filled with nan
+        return {key: [row.get(key, np.nan) for row in rows] for key in keys}
+
+    def to_table(self):
+        """All rows as a tidy table, one row per scene, band and statistic.
+
+        The region column is None for the main aoi.
+        """
+        import pandas as pd
+
+        stats = ["median"] + [f"p{q:g}" for q in self.percentiles] + self.stats
+        frames = []
+        for region in [None] + self.regions:
+            tsdict = self.to_dict(region)
+            if len(tsdict) == 0:
+                continue
+            extra = [key for key in self.metas + ["store"] if key in tsdict]
+            extra.remove("datetime")
+            for bname in self.bands:
+                for stat in stats:
+                    key = stat_key(bname, stat)
+                    if key not in tsdict:
+                        continue
+                    frame = {"time": tsdict["datetime"], "region": region}
+                    frame.update({key: tsdict[key] for key in extra})
+                    frame.update({"band": bname, "stat": stat, "value": tsdict[key]})
+                    frames.append(pd.DataFrame(frame))
+        if len(frames) == 0:
+            return pd.DataFrame(columns=["time", "region", "band", "stat", "value"])
+        table = pd.concat(frames, ignore_index=True)
+        # the main aoi has no region name, keep it as None and not NaN
+        table["region"] = table["region"].astype(object)
+        table.loc[table["region"].isna(), "region"] = None
+        return table
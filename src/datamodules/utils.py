@@ -1,13 +1,21 @@
 import glob
+import hashlib
+import json
+import os
 import pickle
+from datetime import datetime as dt
+from functools import lru_cache
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import geopandas as gpd
-import matplotlib.pyplot as plt
 import numpy as np
-from pyproj import Transformer
-from shapely.geometry import Polygon
-from xarray import DataArray
+
+# geopandas, matplotlib, pyproj, rasterio, shapely and xarray are slow to
+# import, so they are only imported by the functions that use them
+if TYPE_CHECKING:
+    import geopandas as gpd
+    from pyproj import Transformer
+    from xarray import DataArray
 
 
 def psave(obj, path: str) -> None:
@@ -23,32 +31,117 @@ def pload(path: str):
     return obj
 
 
-def crs_transform(xr: DataArray, crs_in: str, crs_out: str) -> DataArray:
-    # first convert x, y to 2D
+@lru_cache(maxsize=32)
+def get_transformer(crs_in: str, crs_out: str) -> "Transformer":
+    """Transformers are slow to build so reuse them for each crs pair."""
+    from pyproj import Transformer
+
+    return Transformer.from_crs(crs_in, crs_out)
+
+
+def crs_transform(
+    xr: "DataArray",
+    crs_in: str,
+    crs_out: str,
+    dtype: type = np.float64,
+    axes_only: bool = False,
+) -> "DataArray":
+    """Transform the x, y coords of a 2D array to another crs.
+
+    The output keeps the pyproj axis order of crs_out, so for EPSG:4326 the "y"
+    coord is lat and the "x" coord is lon. If the output grid is rectilinear use
+    axes_only to transform just the 1D axes instead of every pixel.
+    """
+    from xarray import DataArray
+
     b = xr.values
     xar = xr["x"].values
     yar = xr["y"].values
     attrs = xr.attrs
-    x_2d = np.zeros(b.shape)
-    y_2d = np.zeros(b.shape)
-    for i in range(x_2d.shape[0]):
-        x_2d[i, :] = xar
-    for j in range(x_2d.shape[1]):
-        y_2d[:, j] = yar
-    transformer = Transformer.from_crs(crs_in, crs_out)
+    transformer = get_transformer(crs_in, crs_out)
+    if axes_only:
+        _, lon = transformer.transform(xar, np.full_like(xar, yar[0]))
+        lat, _ = transformer.transform(np.full_like(yar, xar[0]), yar)
+        newcoords = {"y": lat.astype(dtype), "x": lon.astype(dtype)}
+        return DataArray(b, dims=["y", "x"], coords=newcoords, attrs=attrs)
+    # broadcast views of the axes instead of filling 2D arrays
+    x_2d, y_2d = np.broadcast_arrays(xar[np.newaxis, :], yar[:, np.newaxis])
     lat, lon = transformer.transform(x_2d, y_2d)
     newcoords = {}
-    newcoords["y"] = (["x", "y"], lat)
-    newcoords["x"] = (["x", "y"], lon)
+    newcoords["y"] = (["x", "y"], lat.astype(dtype, copy=False))
+    newcoords["x"] = (["x", "y"], lon.astype(dtype, copy=False))
     xr_new = DataArray(b, dims=["x", "y"], coords=newcoords, attrs=attrs)
     return xr_new
 
 
-def lin_to_db(pixelData):
-    pixelDatadB = 10 * np.log10(np.abs(pixelData))
+def bounds_to_window(
+    bounds: list[float], transform, shape: tuple[int], pad: int = 1
+) -> tuple[slice]:
+    """Row and column slices of a raster grid that cover [minx, miny, maxx, maxy]."""
+    inv = ~transform
+    corners = [
+        inv * (x, y) for x in (bounds[0], bounds[2]) for y in (bounds[1], bounds[3])
+    ]
+    cols = [c[0] for c in corners]
+    rows = [c[1] for c in corners]
+    row0 = min(max(int(np.floor(min(rows))) - pad, 0), shape[0])
+    row1 = min(max(int(np.ceil(max(rows))) + pad, 0), shape[0])
+    col0 = min(max(int(np.floor(min(cols))) - pad, 0), shape[1])
+    col1 = min(max(int(np.ceil(max(cols))) + pad, 0), shape[1])
+    return slice(row0, row1), slice(col0, col1)
+
+
+def rasterize_aoi(geoms: list, transform, shape: tuple[int]) -> np.ndarray:
+    """Boolean mask of the pixels of a grid whose centres are inside geoms."""
+    from rasterio.features import geometry_mask
+
+    return geometry_mask(geoms, out_shape=shape, transform=transform, invert=True)
+
+
+def mask_window(mask: np.ndarray) -> tuple[slice]:
+    """Row and column slices of the smallest window holding the mask, or None."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+
+
+def lin_to_db(pixelData, out=None):
+    """Convert to db, pass out=pixelData to convert in place."""
+    pixelDatadB = np.abs(pixelData, out=out)
+    np.log10(pixelDatadB, out=pixelDatadB)
+    pixelDatadB *= 10
     return pixelDatadB
 
 
+def prep_array(
+    arr: np.ndarray, nodata: float = 0, to_db: bool = False, block_rows: int = 1024
+) -> tuple[float]:
+    """Set nodata to nan and optionally convert to db, in place.
+
+    Works through arr in blocks of rows so temporaries are never larger than a
+    block, and returns the (min, max, mean) of the valid pixels from the same pass.
+    """
+    vmin, vmax, total, count = np.inf, -np.inf, 0.0, 0
+    for row in range(0, max(arr.shape[0], 1), block_rows):
+        blk = arr[row : row + block_rows]
+        if nodata is not None:
+            blk[blk == nodata] = np.nan
+        if to_db:
+            lin_to_db(blk, out=blk)
+        n = np.count_nonzero(~np.isnan(blk))
+        if n == 0:
+            continue
+        vmin = min(vmin, np.nanmin(blk))
+        vmax = max(vmax, np.nanmax(blk))
+        total += np.nansum(blk, dtype=np.float64)
+        count += n
+    if count == 0:
+        return np.nan, np.nan, np.nan
+    return vmin, vmax, total / count
+
+
 def get_filelist(dir: str = None, files: list[str] = None, ext: str = "") -> list[str]:
     if ext is None:
         ext = ""
@@ -62,7 +155,41 @@ def get_filelist(dir: str = None, files: list[str] = None, ext: str = "") -> lis
         return files
 
 
+# processing tags in band file names that are not part of the band name
+BAND_TAGS = ["orf", "cs", "c2d", "fenhlee", "cp2rrrl", "poldiscr", "txC"]
+
+
+def parse_scene_meta(file: str, meta_map: dict) -> dict:
+    """Datetime, satellite and beam mode of a scene from its file name."""
+    metastr = os.path.split(file)[1].split("_")
+    try:
+        return {
+            "datetime": dt.strptime(
+                metastr[meta_map["date"]] + metastr[meta_map["time"]], "%Y%m%d%H%M%S"
+            ),
+            "sat": metastr[meta_map["sat"]],
+            "mode": metastr[meta_map["mode"]],
+        }
+    except Exception as e:
+        print(e)
+        raise Exception("probably need to change indexes to metadata in filename")
+
+
+def parse_band_name(file: str, meta_map: dict) -> str:
+    """Band name from a band file name, leaving out the processing tags."""
+    filemeta = os.path.basename(file).split(".")[0].split("_")
+    parts = [part for part in filemeta[meta_map["band"] :] if part not in BAND_TAGS]
+    return "_".join(parts)
+
+
+def list_band_files(dir: str) -> list[str]:
+    """Names of the GeoTIFF bands in a scene directory."""
+    return [file for file in os.listdir(dir) if file[-4:] == ".tif"]
+
+
 def save_fig(figName, **kwargs):
+    import matplotlib.pyplot as plt
+
     figOutDir = ""
     if "figOutDir" in kwargs:
         figOutDir = kwargs.get("figOutDir")
@@ -71,6 +198,21 @@ def save_fig(figName, **kwargs):
     # plt.savefig(figName, format='png', dpi=300)
 
 
+def scene_mtime(path: str) -> float:
+    """Latest modification time of a file, or of anything inside a directory."""
+    mtime = os.path.getmtime(path)
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for file in files:
+                mtime = max(mtime, os.path.getmtime(os.path.join(root, file)))
+    return mtime
+
+
+def hash_aoi(aoi: list, aoi_crs: str = "EPSG:4326") -> str:
+    aoistr = json.dumps([aoi, aoi_crs])
+    return hashlib.sha1(aoistr.encode()).hexdigest()
+
+
 def checkdir(dirstr):
     Path(dirstr).mkdir(parents=True, exist_ok=True)
 
@@ -80,10 +222,92 @@ def create_gdf_from_coords(
     crs: str = "EPSG:4326",
     to_shapefile: bool = False,
     fname: str = "polygon.shp",
-) -> gpd.GeoDataFrame:
-    """Coords should be [[lon, lat], ...]."""
-    polygon_geom = Polygon(coords)
+) -> "gpd.GeoDataFrame":
+    """Coords should be [[lon, lat], ...], or [lon, lat] for a point."""
+    import geopandas as gpd
+    from shapely.geometry import Point, Polygon
+
+    polygon_geom = Point(coords) if np.ndim(coords) == 1 else Polygon(coords)
     polygon = gpd.GeoDataFrame(index=[0], crs=crs, geometry=[polygon_geom])
     if to_shapefile:
         polygon.to_file(filename=fname, driver="ESRI Shapefile")
     return polygon
+
+
+EARTH_RADIUS = 6371008.8
+
+
+def dist_coords(ll1: list[float], ll2: list[float]) -> float:
+    """Input [lon, lat] for each ll."""
+    from geopy.distance import distance
+
+    d = distance((ll1[1], ll1[0]), (ll2[1], ll2[0])).m
+    return d
+
+
+def haversine(lon: np.ndarray, lat: np.ndarray, lon0: float, lat0: float) -> np.ndarray:
+    """Great circle distance in m from (lon0, lat0) to arrays of lon, lat."""
+    lon, lat = np.radians(lon), np.radians(lat)
+    lon0, lat0 = np.radians(lon0), np.radians(lat0)
+    a = (
+        np.sin((lat - lat0) / 2) ** 2
+        + np.cos(lat) * np.cos(lat0) * np.sin((lon - lon0) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def lonlat_to_xyz(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """Points on the unit sphere, chord distance increases with great circle distance."""
+    lon, lat = np.radians(lon), np.radians(lat)
+    return np.column_stack(
+        [
+            np.ravel(np.cos(lat) * np.cos(lon)),
+            np.ravel(np.cos(lat) * np.sin(lon)),
+            np.ravel(np.sin(lat)),
+        ]
+    )
+
+
+class PixelLocator:
+    """Find the pixel nearest to a [lon, lat] point.
+
+    method can be "haversine" (vectorised search), "kdtree" (index built once per
+    grid and reused for scenes that share it, needs scipy) or "geodesic" (exact
+    geopy distance per pixel, slow).
+    """
+
+    def __init__(self, method: str = "haversine") -> None:
+        if method not in ["haversine", "kdtree", "geodesic"]:
+            raise Exception("method should be one of haversine, kdtree, geodesic")
+        self.method = method
+        self.trees = {}
+
+    def grid_key(self, lon: np.ndarray, lat: np.ndarray) -> str:
+        return hashlib.sha1(
+            str(lon.shape).encode() + lon.tobytes() + lat.tobytes()
+        ).hexdigest()
+
+    def get_tree(self, lon: np.ndarray, lat: np.ndarray):
+        from scipy.spatial import cKDTree
+
+        key = self.grid_key(lon, lat)
+        if key not in self.trees:
+            self.trees[key] = cKDTree(lonlat_to_xyz(lon, lat))
+        return self.trees[key]
+
+    def locate(self, lon: np.ndarray, lat: np.ndarray, stn_coords: list[float]):
+        """Return (row, col) of the pixel closest to stn_coords."""
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        if self.method == "kdtree":
+            tree = self.get_tree(lon, lat)
+            _, ind = tree.query(lonlat_to_xyz(stn_coords[0], stn_coords[1])[0])
+        elif self.method == "geodesic":
+            dist = [
+                dist_coords([tlon, tlat], stn_coords)
+                for tlon, tlat in zip(lon.flatten(), lat.flatten())
+            ]
+            ind = np.argmin(dist)
+        else:
+            ind = np.argmin(haversine(lon, lat, stn_coords[0], stn_coords[1]))
+        return np.unravel_index(ind, lon.shape)
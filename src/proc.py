@@ -1,9 +1,13 @@
 import hydra
 from hydra.utils import instantiate
-from omegaconf import DictConfig
+from omegaconf import DictConfig, OmegaConf
 from omegaconf.errors import ConfigAttributeError
 
-from datamodules.base import Datamod, Product
+from datamodules.base import Datamod
+from runner.executor import get_executor
+from runner.manifest import Manifest, config_hash
+from runner.profiler import Profiler
+from runner.scene import process_scene
 
 
 @hydra.main(config_path="conf", config_name="main", version_base=None)
@@ -13,48 +17,70 @@ def main(cfg: DictConfig):
     print("instantiated datamodule")
 
     try:
-        pipeline = cfg.dataset.pipeline
+        pipeline = list(cfg.dataset.pipeline)
     except ConfigAttributeError:
         raise Exception("pipeline is missing from config file")
 
-    if "timeseries" in pipeline:
-        prods = []
+    # plain dict so that the config can be sent to worker processes
+    kwargs = OmegaConf.to_container(cfg.dataset, resolve=True)
+    executor = get_executor(
+        kwargs.get("executor", "serial"), kwargs.get("n_workers", 1)
+    )
+    print(f"running with {executor.n_workers} {type(executor).__name__} worker(s)")
+
+    profiler = Profiler(
+        kwargs.get("profile", False),
+        kwargs.get("profile_hook"),
+        profdir=datamod.outdir + "profile/",
+    )
+
+    # scenes finished by earlier runs with the same config are skipped and
+    # their stored timeseries rows are reused
+    manifest = Manifest(datamod.outdir + "manifest.jsonl", config_hash(kwargs))
+    todo = datamod.filelist
+    if kwargs.get("resume", True):
+        done = [file for file in todo if manifest.is_done(file)]
+        for file in done:
+            for row in manifest.rows(file):
+                datamod.accumulator.add(row)
+        todo = [file for file in todo if file not in done]
+        print(f"skipping {len(done)} files processed in earlier runs")
+
+    # with one worker the next scene can be read while this one is processed
+    if executor.n_workers == 1:
+        datamod.prefetch(todo)
 
     # run processing steps
-    for file in datamod.filelist:
-        print(f"processing file: \n {file}")
-        try:
-            prod: Product = datamod.read_file(file)
-        except Exception as e:
-            print(e)
-            print("issue with file - skipping...")
-
-        for ind, action in enumerate(pipeline):
-            print(f"\n action ({ind+1}/{len(pipeline)}): {action} \n")
-
-            if action == "subset":
-                prod = datamod.subset(prod, **cfg.dataset)
-                if prod is None:
-                    print("skipping file")
-                    break
-                print("successfully obtained subset")
-
-            if action == "plot":
-                datamod.plot(prod, **cfg.dataset)
-
-            if action == "save":
-                datamod.save(prod, **cfg.dataset)
-
-            if action == "timeseries":
-                prods.append(prod)
+    nfailed = 0
+    for file, result, err in executor.run(
+        process_scene, todo, datamod, pipeline, kwargs
+    ):
+        if err is not None:
+            nfailed += 1
+            print(err)
+            print(f"issue with file - skipping... \n {file}")
+            continue
+        rows, outputs, records = result
+        profiler.records += records
+        manifest.record(file, rows, outputs)
+        for row in rows:
+            datamod.accumulator.add(row)
 
     # now collecting data in timeseries
     if "timeseries" in pipeline:
         print("collecting time series to save")
-
-        datamod.timeseries(prods)
-
-    print(f"finished processing {len(datamod.filelist)} files")
+        with profiler.hook("timeseries"), profiler.stage("timeseries"):
+            datamod.timeseries()
+
+    # per-pixel statistics over the stack of scenes
+    if "temporal" in pipeline:
+        print("computing per-pixel temporal statistics")
+        with profiler.hook("temporal"), profiler.stage("temporal"):
+            datamod.temporal()
+
+    datamod.report()
+    profiler.save(datamod.outdir + "profile")
+    print(f"finished processing {len(todo)} files ({nfailed} failed)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+
+class SerialExecutor:
+    """Run tasks one after the other in the calling process."""
+
+    def __init__(self, n_workers: int = 1) -> None:
+        self.n_workers = 1
+
+    def run(self, fn, items: list, *args):
+        """Yield (item, result, error) for each item, in input order."""
+        for item in items:
+            try:
+                yield item, fn(item, *args), None
+            except Exception as e:
+                yield item, None, e
+
+
+class PoolExecutor(SerialExecutor):
+    pool_cls = None
+
+    def __init__(self, n_workers: int = 1) -> None:
+        self.n_workers = max(1, int(n_workers))
+
+    def run(self, fn, items: list, *args):
+        """Yield (item, result, error) for each item, as tasks complete."""
+        with self.pool_cls(max_workers=self.n_workers) as pool:
+            futures = {pool.submit(fn, item, *args): item for item in items}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+
+
+class ThreadExecutor(PoolExecutor):
+    pool_cls = ThreadPoolExecutor
+
+
+class ProcessExecutor(PoolExecutor):
+    pool_cls = ProcessPoolExecutor
+
+
+EXECUTORS = {
+    "serial": SerialExecutor,
+    "thread": ThreadExecutor,
+    "process": ProcessExecutor,
+}
+
+
+def get_executor(name: str = "serial", n_workers: int = 1) -> SerialExecutor:
+    if name not in EXECUTORS:
+        raise Exception(f"executor should be one of: {list(EXECUTORS)}")
+    if n_workers is None or n_workers <= 1:
+        name = "serial"
+    return EXECUTORS[name](n_workers)
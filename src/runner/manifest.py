@@ -0,0 +1,108 @@
+import json
+import os
+from datetime import datetime as dt
+
+from datamodules.cache import make_key
+from datamodules.utils import checkdir, scene_mtime
+
+# config keys that do not change what is made from a scene
+RUNTIME_KEYS = [
+    "cwd",
+    "datasets_path",
+    "dir",
+    "files",
+    "sdt",
+    "edt",
+    "catalog",
+    "sats",
+    "modes",
+    "bands_required",
+    "executor",
+    "n_workers",
+    "cache",
+    "cache_size_mb",
+    "ee_cache",
+    "ee_cache_dir",
+    "ee_cache_size_mb",
+    "ee_search_ttl_h",
+    "resume",
+    "band_workers",
+    "prefetch",
+    "profile",
+    "profile_hook",
+]
+
+
+def config_hash(kwargs: dict) -> str:
+    """Hash of the dataset config, leaving out keys that only affect the run."""
+    return make_key({k: v for k, v in kwargs.items() if k not in RUNTIME_KEYS})
+
+
+def fingerprint(file: str) -> str:
+    """Fingerprint of a scene from its path, size and modification time.
+
+    Scenes that are not local files (e.g. earth engine ids) are fingerprinted
+    by their name only.
+    """
+    if not os.path.exists(file):
+        return make_key(file)
+    return make_key(os.path.abspath(file), os.path.getsize(file), scene_mtime(file))
+
+
+class Manifest:
+    """Json lines record of the scenes finished by earlier runs.
+
+    Each line holds the scene, its fingerprint, the config hash, the outputs
+    written for it and its timeseries rows. A later line for the same scene
+    replaces the earlier ones, and a line cut short by a crash is ignored.
+    """
+
+    def __init__(self, path: str, config: str) -> None:
+        self.path = path
+        self.config = config
+        self.entries = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.entries[entry["file"]] = entry
+        checkdir(os.path.dirname(path) or ".")
+
+    def is_done(self, file: str) -> bool:
+        """True if the scene was processed with this config, has not changed and
+        the files written for it (outputs and row stores) are still there."""
+        entry = self.entries.get(file)
+        if entry is None or entry["config"] != self.config:
+            return False
+        if entry["fingerprint"] != fingerprint(file):
+            return False
+        paths = entry["outputs"] + [
+            row["store"] for row in entry["rows"] if "store" in row
+        ]
+        return all(os.path.exists(path) for path in paths)
+
+    def record(self, file: str, rows: list[dict], outputs: list[str]) -> None:
+        entry = {
+            "file": file,
+            "fingerprint": fingerprint(file),
+            "config": self.config,
+            "outputs": outputs,
+            "rows": rows,
+            "finished": dt.now().isoformat(),
+        }
+        self.entries[file] = entry
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+
+    def rows(self, file: str) -> list[dict]:
+        """Stored timeseries rows of a scene."""
+        rows = []
+        for row in self.entries[file]["rows"]:
+            row = dict(row)
+            if row.get("datetime") is not None:
+                row["datetime"] = dt.fromisoformat(row["datetime"])
+            rows.append(row)
+        return rows
@@ -0,0 +1,218 @@
+import cProfile
+import csv
+import json
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+
+from datamodules.utils import checkdir
+
+PROFILE_HOOKS = [None, "cprofile"]
+
+# only one cProfile can be active at a time (python >= 3.12 raises otherwise)
+_hook_lock = threading.Lock()
+# running memory peaks (MB) of the stages open in this process
+_open_peaks = []
+_peak_lock = threading.Lock()
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of the process so far, None if unknown."""
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on linux, bytes on mac
+        return peak / 1e6 if platform.system() == "Darwin" else peak / 1e3
+    except ImportError:
+        try:
+            import psutil
+
+            return psutil.Process().memory_info().peak_wset / 1e6
+        except (ImportError, AttributeError):
+            return None
+
+
+def hwm_mb() -> float:
+    """Peak resident memory since the last reset_hwm, None if unknown."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1e3
+    except OSError:
+        pass
+    return None
+
+
+def reset_hwm() -> bool:
+    """Reset the peak resident memory to the current one (linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def fold_peaks() -> bool:
+    """Add the memory peak since the last reset to the open stages and reset
+    it, False if the peak cannot be reset. Call with _peak_lock held."""
+    peak = hwm_mb()
+    if peak is None or not reset_hwm():
+        return False
+    for stage in _open_peaks:
+        stage[0] = max(stage[0], peak)
+    return True
+
+
+def bytes_read() -> int:
+    """Bytes the process read from disk so far (not from the page cache),
+    None if unknown."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("read_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import psutil
+
+        return psutil.Process().io_counters().read_bytes
+    except (ImportError, AttributeError):
+        return None
+
+
+def ee_calls() -> int:
+    from datamodules.ee_scheduler import get_scheduler
+
+    return get_scheduler().ncalls()
+
+
+def snapshot() -> dict:
+    return {
+        "wall": time.perf_counter(),
+        "cpu": time.process_time(),
+        "bytes": bytes_read(),
+        "ee": ee_calls(),
+    }
+
+
+class Profiler:
+    """Record wall time, cpu time, peak memory, bytes read and earth engine
+    requests of each pipeline stage.
+
+    Records are plain dicts so they can be sent back from worker processes and
+    merged into the run report. The peak memory of a stage is the highest
+    resident memory while it ran, found by resetting the kernel high-water
+    mark at each stage boundary (linux, elsewhere it is the peak of the process
+    so far). Bytes read are read from disk, not from the page cache. Cpu time,
+    bytes read and peak memory are process wide, so they include the
+    band_workers threads and, with thread workers, the scenes running
+    alongside. With hook="cprofile" a block can
+    also be run under cProfile and its stats are dumped to
+    profdir/<name>.prof. Only one block is profiled at a time, with thread
+    workers the scenes that start while another one is profiled are skipped.
+    """
+
+    def __init__(
+        self, enabled: bool = False, hook: str = None, profdir: str = None
+    ) -> None:
+        if hook not in PROFILE_HOOKS:
+            raise Exception(f"profile_hook should be one of: {PROFILE_HOOKS}")
+        self.enabled = enabled
+        self.hook_name = hook
+        self.profdir = profdir
+        self.records = []
+
+    @contextmanager
+    def stage(self, stage: str, scene: str = None):
+        if not self.enabled:
+            yield
+            return
+        start = snapshot()
+        peak = [0.0]
+        with _peak_lock:
+            tracked = fold_peaks()
+            _open_peaks.append(peak)
+        try:
+            yield
+        finally:
+            with _peak_lock:
+                fold_peaks()
+                _open_peaks[:] = [stage for stage in _open_peaks if stage is not peak]
+            end = snapshot()
+            nbytes = None
+            if start["bytes"] is not None and end["bytes"] is not None:
+                nbytes = end["bytes"] - start["bytes"]
+            self.records.append(
+                {
+                    "scene": scene,
+                    "stage": stage,
+                    "wall_s": end["wall"] - start["wall"],
+                    "cpu_s": end["cpu"] - start["cpu"],
+                    "peak_rss_mb": peak[0] if tracked else peak_rss_mb(),
+                    "bytes_read": nbytes,
+                    "ee_calls": end["ee"] - start["ee"],
+                }
+            )
+
+    @contextmanager
+    def hook(self, name: str):
+        """Run the block under cProfile if the hook is on and no other block
+        is being profiled."""
+        if self.hook_name != "cprofile":
+            yield
+            return
+        if not _hook_lock.acquire(blocking=False):
+            print(f"not profiling {name}, another block is being profiled")
+            yield
+            return
+        try:
+            prof = cProfile.Profile()
+            prof.enable()
+            try:
+                yield
+            finally:
+                prof.disable()
+                checkdir(self.profdir)
+                prof.dump_stats(os.path.join(self.profdir, name + ".prof"))
+        finally:
+            _hook_lock.release()
+
+    def summary(self) -> dict:
+        """Totals of each stage, over all scenes."""
+        out = {}
+        for rec in self.records:
+            tot = out.setdefault(rec["stage"], {"n": 0, "wall_s": 0.0, "cpu_s": 0.0})
+            tot["n"] += 1
+            tot["wall_s"] += rec["wall_s"]
+            tot["cpu_s"] += rec["cpu_s"]
+        return out
+
+    def save(self, path: str) -> None:
+        """Write the records and summary to path.json and path.csv."""
+        if not self.enabled or len(self.records) == 0:
+            return
+        summary = self.summary()
+        scenes = [rec for rec in self.records if rec["stage"] == "scene"]
+        slowest = sorted(scenes, key=lambda rec: rec["wall_s"], reverse=True)[:5]
+        with open(path + ".json", "w") as f:
+            json.dump(
+                {"summary": summary, "slowest": slowest, "records": self.records},
+                f,
+                indent=2,
+            )
+        with open(path + ".csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(self.records[0]))
+            writer.writeheader()
+            writer.writerows(self.records)
+        print("time per stage (s):")
+        for stage, tot in summary.items():
+            print(
+                f"{stage:<12}{tot['n']:>6}{tot['wall_s']:>10.2f}{tot['cpu_s']:>10.2f}"
+            )
+        print(f"saved profile to: {path}.json")
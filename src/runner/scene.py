@@ -0,0 +1,67 @@
+import os
+
+from datamodules.base import Datamod, Product
+from runner.profiler import Profiler
+
+
+def process_scene(file: str, datamod: Datamod, pipeline: list[str], kwargs: dict):
+    """Run the per-scene pipeline actions on one file.
+
+    Returns the timeseries rows of the scene (empty if they are not needed), the
+    files written for it and the profile records of its stages.
+    """
+    profiler = Profiler(
+        kwargs.get("profile", False),
+        kwargs.get("profile_hook"),
+        profdir=datamod.outdir + "profile/",
+    )
+    scene = os.path.basename(file.rstrip("/"))
+    with profiler.hook(scene), profiler.stage("scene", scene):
+        rows, outputs = run_actions(file, datamod, pipeline, kwargs, profiler, scene)
+    return rows, outputs, profiler.records
+
+
+def run_actions(
+    file: str,
+    datamod: Datamod,
+    pipeline: list[str],
+    kwargs: dict,
+    profiler: Profiler,
+    scene: str,
+):
+    print(f"processing file: \n {file}")
+    with profiler.stage("read_file", scene):
+        prod: Product = datamod.read_file(file)
+
+    for ind, action in enumerate(pipeline):
+        print(f"\n action ({ind+1}/{len(pipeline)}): {action} \n")
+
+        if action == "subset":
+            with profiler.stage(action, scene):
+                prod = datamod.subset(prod, **kwargs)
+            if prod is None:
+                print("skipping file")
+                return [], []
+            print("successfully obtained subset")
+
+        if action == "bandmath":
+            with profiler.stage(action, scene):
+                datamod.bandmath(prod, **kwargs)
+
+        if action == "plot":
+            with profiler.stage(action, scene):
+                datamod.plot(prod, **kwargs)
+
+        if action == "save":
+            with profiler.stage(action, scene):
+                datamod.save(prod, **kwargs)
+
+    rows = []
+    if "timeseries" in pipeline or "temporal" in pipeline:
+        # reduce the scene here so only the small rows are sent back
+        with profiler.stage("summarise", scene):
+            rows = datamod.summarise(prod)
+        for row in rows:
+            if "store" in row:
+                prod.outputs.append(row["store"])
+    return rows, prod.outputs
@@ -0,0 +1,103 @@
+import random
+import time
+
+import pytest
+
+from datamodules.ee_scheduler import RequestScheduler, TokenBucket, is_retryable
+
+
+class EEException(Exception):
+    """Stands in for ee.EEException."""
+
+
+class HttpError(Exception):
+    """Stands in for googleapiclient.errors.HttpError."""
+
+    def __init__(self, status: int) -> None:
+        super().__init__(f"http {status}")
+        self.resp = type("Resp", (), {"status": status})()
+
+
+def ee_error(status: int) -> EEException:
+    """An EEException raised while handling an HttpError, like the ee client."""
+    try:
+        try:
+            raise HttpError(status)
+        except HttpError:
+            raise EEException("request failed")
+    except EEException as e:
+        return e
+
+
+class Flaky:
+    """Raise the given errors in turn, then return "ok"."""
+
+    def __init__(self, errors: list) -> None:
+        self.errors = list(errors)
+        self.ncalls = 0
+
+    def __call__(self):
+        self.ncalls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def scheduler(**kwargs) -> RequestScheduler:
+    return RequestScheduler(rate=0, backoff=0, **kwargs)
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retries_status_in_exception_chain(status):
+    fn = Flaky([ee_error(status), ee_error(status)])
+    sched = scheduler(max_retries=5)
+    assert sched.call(fn) == "ok"
+    assert fn.ncalls == 3
+    assert sched.nretries == 2
+
+
+@pytest.mark.parametrize("status", [400, 403, 404])
+def test_client_errors_are_not_retried(status):
+    fn = Flaky([ee_error(status)])
+    sched = scheduler(max_retries=5)
+    with pytest.raises(EEException):
+        sched.call(fn)
+    assert fn.ncalls == 1
+    assert sched.nerrors == 1
+
+
+def test_message_text_is_not_retried():
+    err = EEException("User memory limit exceeded. Reduce to 500 elements")
+    assert not is_retryable(err)
+    assert is_retryable(TimeoutError())
+    assert is_retryable(ConnectionResetError())
+
+
+def test_max_retries():
+    fn = Flaky([ee_error(503)] * 10)
+    sched = scheduler(max_retries=3)
+    with pytest.raises(EEException):
+        sched.call(fn)
+    assert fn.ncalls == 4
+    assert sched.nretries == 3
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=50, burst=1)
+    t0 = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    # the first call uses the burst, the other 10 wait 1 / rate each
+    assert time.monotonic() - t0 >= 10 / 50 * 0.9
+
+
+def test_map_keeps_input_order():
+    sched = scheduler(max_workers=4)
+
+    def slow_square(x: int) -> int:
+        time.sleep(random.random() / 50)
+        return x * x
+
+    items = list(range(20))
+    assert sched.map(slow_square, items) == [x * x for x in items]
+    assert sched.ncalls() == len(items)